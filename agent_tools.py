@@ -1,24 +1,20 @@
-from dotenv import load_dotenv
-from agents import function_tool
-import requests
 import os
 from typing import Dict, Optional, Any, List, TypedDict
 import json
 import asyncio
 import base64
-import sqlite3
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
-try:
-    import nest_asyncio
-    nest_asyncio.apply()
-except ImportError:
-    pass
+from sqlite_memory import SQLiteMemory, build_fts_query
+from metrics import registry, timed
+from confluence_config import get_config
+from confluence_gateway import get_gateway
 
-from atlassian import Confluence
-from sqlite_memory import SQLiteMemory
-
-# Laad omgevingsvariabelen
-load_dotenv(override=True)
+# Importeren heeft geen bijwerkingen: de database, nest_asyncio, de agents SDK en
+# atlassian worden pas bij init_agent_tools() of het eerste gebruik geladen.
+# Confluence-aanroepen gaan via de gedeelde client uit confluence_gateway.py.
 
 # Helper om async functie te runnen, ook in bestaande event loop
 async def _run_async_or_sync(coro):
@@ -31,10 +27,48 @@ async def _run_async_or_sync(coro):
 
 # Zorg dat het pad naar de database klopt
 DB_PATH = os.path.join(os.path.dirname(__file__), "agent_memory.db")
-memory = SQLiteMemory(DB_PATH)
 
-def init_kennisbank():
-    conn = sqlite3.connect(DB_PATH)
+memory = None
+vector_index = None
+_init_lock = threading.Lock()
+
+def init_agent_tools(shared_memory=None):
+    """
+    Koppel de tools aan een SQLiteMemory (standaard agent_memory.db met group commits)
+    en maak de kennisbank aan. Geeft de memory terug; een tweede aanroep doet niets.
+    """
+    global memory, vector_index
+    with _init_lock:
+        if memory is not None:
+            return memory
+        try:
+            import nest_asyncio
+            nest_asyncio.apply()
+        except ImportError:
+            pass
+        if shared_memory is None:
+            # Zelfstandig gebruik: omgevingsvariabelen zelf laden
+            from dotenv import load_dotenv
+            load_dotenv(override=True)
+            # Inserts gaan via group commits van een achtergrond-writer
+            shared_memory = SQLiteMemory(DB_PATH, buffered_writes=True)
+        from vector_index import VectorIndex
+        # Semantische index naast de database; wordt bij de eerste zoekvraag (opnieuw) opgebouwd
+        vector_index = VectorIndex(shared_memory, os.path.dirname(shared_memory.db_path))
+        init_kennisbank(shared_memory)
+        memory = shared_memory
+        return memory
+
+def _memory():
+    return memory if memory is not None else init_agent_tools()
+
+def _vector_index():
+    _memory()
+    return vector_index
+
+def init_kennisbank(memory):
+    # Gebruikt de persistente verbinding van SQLiteMemory voor deze thread
+    conn = memory.connection()
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS kennis (
@@ -43,37 +77,126 @@ def init_kennisbank():
             inhoud TEXT
         )
     """)
+    # Full-text index op de kennisbank, bijgehouden via triggers
+    bestaat = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kennis_fts'"
+    ).fetchone()
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS kennis_fts USING fts5(
+            onderwerp, inhoud, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS kennis_fts_insert AFTER INSERT ON kennis BEGIN
+            INSERT INTO kennis_fts (rowid, onderwerp, inhoud) VALUES (new.id, new.onderwerp, new.inhoud);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS kennis_fts_update AFTER UPDATE ON kennis BEGIN
+            DELETE FROM kennis_fts WHERE rowid = old.id;
+            INSERT INTO kennis_fts (rowid, onderwerp, inhoud) VALUES (new.id, new.onderwerp, new.inhoud);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS kennis_fts_delete AFTER DELETE ON kennis BEGIN
+            DELETE FROM kennis_fts WHERE rowid = old.id;
+        END
+    """)
+    if not bestaat:
+        # Bestaande kennis indexeren
+        c.execute("INSERT INTO kennis_fts (rowid, onderwerp, inhoud) SELECT id, onderwerp, inhoud FROM kennis")
     conn.commit()
-    conn.close()
-
-init_kennisbank()
 
-@function_tool
 def kennisbank_opslaan(onderwerp: str, inhoud: str) -> str:
     """Sla kennis op in de kennisbank onder een onderwerp."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO kennis (onderwerp, inhoud) VALUES (?, ?)", (onderwerp, inhoud))
-    conn.commit()
-    conn.close()
+    _memory().write("INSERT INTO kennis (onderwerp, inhoud) VALUES (?, ?)", (onderwerp, inhoud))
     return f"Kennis opgeslagen onder onderwerp: {onderwerp}"
 
-@function_tool
 def kennisbank_zoeken(zoekterm: str) -> str:
-    """Zoek naar kennis in de kennisbank op basis van een zoekterm."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT onderwerp, inhoud FROM kennis WHERE onderwerp LIKE ? OR inhoud LIKE ? LIMIT 5", (f"%{zoekterm}%", f"%{zoekterm}%"))
+    """Zoek naar kennis in de kennisbank op basis van een of meer zoektermen."""
+    fts_query = build_fts_query(zoekterm)
+    if fts_query is None:
+        return "Geen kennis gevonden."
+    # Net opgeslagen kennis moet vindbaar zijn
+    memory = _memory()
+    memory.flush()
+    c = memory.connection().cursor()
+    # Beste bm25-match eerst; het onderwerp weegt zwaarder dan de inhoud
+    c.execute("""
+        SELECT onderwerp, snippet(kennis_fts, 1, '[', ']', ' ... ', 64)
+        FROM kennis_fts
+        WHERE kennis_fts MATCH ?
+        ORDER BY bm25(kennis_fts, 5.0, 1.0)
+        LIMIT 5
+    """, (fts_query,))
     resultaten = c.fetchall()
-    conn.close()
     if not resultaten:
         return "Geen kennis gevonden."
     return "\n\n".join([f"Onderwerp: {r[0]}\nInhoud: {r[1]}" for r in resultaten])
 
-@function_tool
+def confluence_semantisch_zoeken(vraag: str) -> str:
+    """
+    Zoek in de opgeslagen Confluence-pagina's op betekenis in plaats van exacte woorden.
+    Gebruik dit als een vraag anders geformuleerd is dan de tekst op de pagina's.
+    """
+    resultaten = _vector_index().get_context(vraag)
+    if not resultaten:
+        return "Geen relevante Confluence-secties gevonden."
+    return resultaten
+
+# Lopende upstream-fetches per page_id, zodat gelijktijdige aanvragen er één delen
+_inflight = {}
+_inflight_lock = threading.Lock()
+_revalidator = None
+
+def _fetch_confluence_page(page_id):
+    """Haal een pagina op bij Confluence en sla hem op; geeft (titel, genormaliseerde inhoud) of None."""
+    gateway = get_gateway()
+    if gateway is None:
+        raise RuntimeError("Ontbrekende Confluence API credentials in .env")
+    # Automatisch opslaan in de database; de opmaak wordt eenmalig per versie genormaliseerd
+    return gateway.fetch_and_store(page_id, _memory())
+
+def _fetch_coalesced(page_id):
+    """_fetch_confluence_page, maar gelijktijdige aanroepen voor dezelfde page_id wachten op één fetch."""
+    with _inflight_lock:
+        future = _inflight.get(page_id)
+        eigenaar = future is None
+        if eigenaar:
+            future = _inflight[page_id] = Future()
+    if not eigenaar:
+        registry.increment("confluence_page_fetch_coalesced")
+        return future.result()
+    try:
+        registry.increment("confluence_page_fetches")
+        future.set_result(_fetch_confluence_page(page_id))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            del _inflight[page_id]
+    return future.result()
+
+def _revalidate(page_id):
+    try:
+        _fetch_coalesced(page_id)
+    except Exception as e:
+        print(f"⚠️ Verversen van Confluence-pagina {page_id} mislukt: {e}")
+
+def _revalidate_in_background(page_id):
+    global _revalidator
+    with _inflight_lock:
+        if page_id in _inflight:
+            return
+        if _revalidator is None:
+            _revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix="confluence-revalidate")
+    _revalidator.submit(_revalidate, page_id)
+
 def haal_confluence_pagina_op(page_id: str) -> dict:
     """
     Haalt de inhoud op van een Confluence-pagina op basis van page_id.
+    Een opgeslagen kopie die jonger is dan page_cache_ttl wordt direct gebruikt; een oudere
+    kopie (tot page_cache_max_stale) ook, maar die wordt op de achtergrond ververst.
     Vereist CONFLUENCE_BASE_URL, CONFLUENCE_EMAIL en CONFLUENCE_API_TOKEN in de .env.
 
     Argumenten:
@@ -83,39 +206,68 @@ def haal_confluence_pagina_op(page_id: str) -> dict:
     Returns:
         dict: Resultaat van de API-call, met status en inhoud of foutmelding.
     """
-    url = os.environ.get("CONFLUENCE_BASE_URL")
-    email = os.environ.get("CONFLUENCE_EMAIL")
-    api_token = os.environ.get("CONFLUENCE_API_TOKEN")
-    if not url or not email or not api_token:
-        return {"status": "fout", "bericht": "Ontbrekende Confluence API credentials in .env"}
-    try:
-        confluence = Confluence(
-            url=url,
-            username=email,
-            password=api_token
-        )
-        pagina = confluence.get_page_by_id(page_id, expand="body.storage")
-        if pagina and "body" in pagina and "storage" in pagina["body"]:
-            inhoud = pagina["body"]["storage"]["value"]
-            titel = pagina.get("title", f"Confluence pagina {page_id}")
-            # Automatisch opslaan in de database
-            memory.add_confluence_page(page_id, titel, inhoud)
-            return {"status": "succes", "inhoud": inhoud, "titel": titel}
+    config = get_config()
+    opgeslagen = _memory().get_cached_confluence_page(page_id)
+    leeftijd = opgeslagen["age_seconds"] if opgeslagen else None
+    if leeftijd is not None and leeftijd <= config["page_cache_max_stale"]:
+        if leeftijd <= config["page_cache_ttl"]:
+            registry.increment("confluence_page_cache_hits")
         else:
-            return {"status": "fout", "bericht": f"Pagina met ID '{page_id}' niet gevonden."}
+            registry.increment("confluence_page_cache_stale")
+            _revalidate_in_background(page_id)
+        return {"status": "succes", "inhoud": opgeslagen["content"], "titel": opgeslagen["title"]}
+
+    registry.increment("confluence_page_cache_misses")
+    try:
+        resultaat = _fetch_coalesced(page_id)
     except Exception as e:
+        if opgeslagen:
+            # Confluence onbereikbaar: een verouderde kopie is beter dan niets
+            return {"status": "succes", "inhoud": opgeslagen["content"], "titel": opgeslagen["title"]}
         return {"status": "fout", "bericht": f"Fout bij ophalen Confluence-pagina: {str(e)}"}
+    if resultaat is None:
+        return {"status": "fout", "bericht": f"Pagina met ID '{page_id}' niet gevonden."}
+    titel, inhoud = resultaat
+    return {"status": "succes", "inhoud": inhoud, "titel": titel}
 
-@function_tool
 def confluence_pagina_opslaan_en_indexeren(page_id: str, title: str, content: str) -> str:
     """Sla een opgehaalde Confluence-pagina op in de database."""
-    memory.add_confluence_page(page_id, title, content)
+    # Door de agent aangeleverde inhoud telt niet als verse kopie uit Confluence
+    _memory().add_confluence_page(page_id, title, content, fetched=False)
     return f"Confluence-pagina '{title}' opgeslagen."
 
 def confluence_zoeken_in_db(zoekterm: str) -> str:
     """Zoek in de opgeslagen Confluence-pagina's in de database."""
-    resultaten = memory.search_confluence_pages(zoekterm)
+    resultaten = _memory().search_confluence_snippets(zoekterm)
     if not resultaten:
         return "Geen relevante Confluence-pagina's gevonden."
-    return "\n\n".join([f"Titel: {r[1]}\nInhoud: {r[2][:500]}..." for r in resultaten])
+    return "\n\n".join([f"Titel: {r[1]} (ID: {r[0]})\nFragment: {r[2]}" for r in resultaten])
+
+# Functies die als tool aan de agent gegeven kunnen worden
+TOOL_FUNCTIONS = [
+    kennisbank_opslaan,
+    kennisbank_zoeken,
+    confluence_semantisch_zoeken,
+    haal_confluence_pagina_op,
+    confluence_pagina_opslaan_en_indexeren,
+]
 
+def _in_thread(fn):
+    """
+    Async variant van een sync tool. De agents SDK roept sync tools direct op de event
+    loop aan; zo draait de body (netwerk, wachten op een gedeelde fetch, het opbouwen
+    van de index) in een worker-thread en lopen de streams van andere gebruikers door.
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return wrapper
+
+def get_tools(*functions):
+    """
+    Maak agent-tools van de gegeven functies (standaard alle TOOL_FUNCTIONS).
+    De agents SDK wordt pas hier geimporteerd. Elke aanroep draait in een worker-thread
+    en wordt gemeten als span tool.<naam>.
+    """
+    from agents import function_tool
+    return [function_tool(_in_thread(timed(f"tool.{f.__name__}")(f))) for f in (functions or TOOL_FUNCTIONS)]
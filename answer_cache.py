@@ -0,0 +1,123 @@
+"""
+Persistent cache of agent answers.
+
+Answers are keyed by the normalized question and the fingerprint of the stored
+Confluence pages, so a changed page invalidates every cached answer. Entries
+expire after a TTL and the least recently used ones are evicted beyond a size
+cap. Hit and miss counters are kept per process.
+
+The key holds no conversation state, so chat() only uses the cache for the
+first question of a session and only stores answers of runs without tool calls.
+"""
+import hashlib
+import re
+import threading
+from datetime import datetime, timedelta
+
+from confluence_config import get_answer_cache_config
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_question(question):
+    """Lowercase words only, so case, punctuation and spacing do not matter."""
+    return " ".join(_WORD_RE.findall(question.lower()))
+
+
+class AnswerCache:
+    """Answer cache stored in the answer_cache table of a SQLiteMemory database."""
+
+    def __init__(self, memory, config=None):
+        self.memory = memory
+        self.config = config or get_answer_cache_config()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self.memory.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    question TEXT,
+                    kb_fingerprint TEXT,
+                    answer TEXT,
+                    created TEXT,
+                    last_used TEXT,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON answer_cache(last_used)")
+
+    def _key(self, question, fingerprint):
+        return hashlib.md5(f"{fingerprint}:{normalize_question(question)}".encode('utf-8')).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, question):
+        """Return the cached answer for the question, or None on a miss."""
+        if not self.config["enabled"] or not normalize_question(question):
+            return None
+        key = self._key(question, self.memory.get_confluence_fingerprint())
+        now = datetime.now()
+        with self.memory.connection() as conn:
+            row = conn.execute(
+                "SELECT answer, created FROM answer_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row and row[1] >= (now - timedelta(seconds=self.config["ttl_seconds"])).isoformat():
+                conn.execute(
+                    "UPDATE answer_cache SET last_used = ?, hits = hits + 1 WHERE cache_key = ?",
+                    (now.isoformat(), key)
+                )
+                self._count(True)
+                return row[0]
+            if row:
+                conn.execute("DELETE FROM answer_cache WHERE cache_key = ?", (key,))
+        self._count(False)
+        return None
+
+    def put(self, question, answer):
+        """Store an answer and evict expired, outdated and least recently used entries."""
+        if not self.config["enabled"] or not answer or not normalize_question(question):
+            return
+        fingerprint = self.memory.get_confluence_fingerprint()
+        now = datetime.now()
+        with self.memory.connection() as conn:
+            conn.execute(
+                "REPLACE INTO answer_cache (cache_key, question, kb_fingerprint, answer, created, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (self._key(question, fingerprint), normalize_question(question), fingerprint,
+                 answer, now.isoformat(), now.isoformat())
+            )
+            # Answers based on other page contents can never be hit again
+            conn.execute("DELETE FROM answer_cache WHERE kb_fingerprint != ?", (fingerprint,))
+            conn.execute(
+                "DELETE FROM answer_cache WHERE created < ?",
+                ((now - timedelta(seconds=self.config["ttl_seconds"])).isoformat(),)
+            )
+            conn.execute("""
+                DELETE FROM answer_cache WHERE cache_key IN (
+                    SELECT cache_key FROM answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.config["max_entries"],))
+
+    def clear(self):
+        with self.memory.connection() as conn:
+            conn.execute("DELETE FROM answer_cache")
+
+    def stats(self):
+        """Hit/miss counters of this process and the number of stored answers."""
+        with self.memory.connection() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+        }
@@ -1,19 +1,23 @@
-from dotenv import load_dotenv
-from agents import Agent, Runner, trace, function_tool
 import asyncio
 from datetime import datetime
-import gradio as gr
+import importlib
 import os
+import re
+import time
+from typing import TYPE_CHECKING
 
+# Importing this module has no side effects: the database, .env, Confluence, the
+# agents SDK and gradio are only touched by startup() / create_app() below.
 # https://platform.openai.com/traces om naar de trace te gaan
-# Load environment variables (make sure your .env has OPENAI_API_KEY)
-load_dotenv(override=True)
 
 # Import tools from the separate agent-tools module
 from agent_tools import (
 
+    init_agent_tools,
+    get_tools,
     kennisbank_opslaan,
     kennisbank_zoeken,
+    confluence_semantisch_zoeken,
     haal_confluence_pagina_op    # Just the function reference
 )
 
@@ -21,136 +25,289 @@ from agent_tools import (
 from sqlite_memory import SQLiteMemory
 
 # Import confluence configuration
-from confluence_config import get_predefined_pages
+from confluence_config import get_predefined_pages, get_config, get_crawl_config, get_pages_dir
+
+# Per-page, content-addressed file store of the normalized pages
+from page_store import PageStore
+
+# One pooled, keep-alive Confluence client for the loader and the tools
+from confluence_gateway import get_gateway, page_version, store_page
+
+# Crawling of whole spaces and page trees
+from confluence_crawler import ConfluenceCrawler, crawl_id_for
+
+# Concurrent page fetching with retries
+from confluence_loader import dedupe_pages, load_pages_concurrently
+
+# Local retrieval over the stored Confluence pages
+from retrieval import KnowledgeRetriever
+
+# Token-budgeted prompt assembly
+from context_builder import ContextBuilder, format_report
+
+# Answers to repeated questions, invalidated when a page changes
+from answer_cache import AnswerCache
+
+# Local timing spans and the /metrics endpoint
+from metrics import registry, span, start_metrics_server
+from confluence_config import get_metrics_config
+
+class _LazyModule:
+    """Stand-in for a module that is only imported on the first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+if TYPE_CHECKING:
+    import gradio as gr
+else:
+    # gradio is slow to import; this also lets Gradio resolve chat()'s "gr.Request"
+    # hint (and so pass the session) however chat is handed to it
+    gr = _LazyModule("gradio")
 
 # Use absolute path for persistent memory
 db_path = os.path.join(os.path.dirname(__file__), "agent_memory.db")
-memory = SQLiteMemory(db_path)
+# One file per page (see page_store.py); the old single file is only read to migrate it
+confluence_pages_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), get_pages_dir()))
+confluence_content_file = os.path.join(os.path.dirname(__file__), "confluence_content.txt")
+
+# Startup budget in seconds (without the Confluence sync); measure imports with
+# python -X importtime -c "import app"
+COLD_START_BUDGET = 2.0
 
-def get_confluence_page_content(page_id: str) -> dict:
+# Set by startup()
+memory = None
+retriever = None
+context_builder = None
+answer_cache = None
+page_store = None
+agent_researcher = None
+
+def get_confluence_page_content(page_id: str, gateway=None) -> dict:
     """
     Retrieve content from a Confluence page by page_id.
     This is a regular function (not a tool) that can be called directly.
+    Uses the shared gateway unless another one is passed.
     """
-    from atlassian import Confluence
-    
-    url = os.environ.get("CONFLUENCE_BASE_URL")
-    email = os.environ.get("CONFLUENCE_EMAIL")
-    api_token = os.environ.get("CONFLUENCE_API_TOKEN")
-    
-    if not url or not email or not api_token:
+    if gateway is None:
+        gateway = get_gateway()
+    if gateway is None:
         return {"status": "fout", "bericht": "Ontbrekende Confluence API credentials in .env"}
     
     try:
-        confluence = Confluence(
-            url=url,
-            username=email,
-            password=api_token
-        )
-        pagina = confluence.get_page_by_id(page_id, expand="body.storage")
-        if pagina and "body" in pagina and "storage" in pagina["body"]:
-            inhoud = pagina["body"]["storage"]["value"]
-            titel = pagina.get("title", f"Confluence pagina {page_id}")
-            # Automatisch opslaan in de database
-            memory.add_confluence_page(page_id, titel, inhoud)
+        resultaat = gateway.fetch_and_store(page_id, memory)
+        if resultaat:
+            titel, inhoud = resultaat
             return {"status": "succes", "inhoud": inhoud, "titel": titel}
         else:
             return {"status": "fout", "bericht": f"Pagina met ID '{page_id}' niet gevonden."}
     except Exception as e:
         return {"status": "fout", "bericht": f"Fout bij ophalen Confluence-pagina: {str(e)}"}
 
-def load_all_confluence_pages():
+def load_all_confluence_pages(incremental=None):
     """
     Load all Confluence pages from confluence_config.py by page_id and store their content
-    in confluence_content.txt. If the file already exists, it will be overwritten.
+    in the page store (one file per page, see page_store.py). Returns the store directory.
+    Duplicate page ids are fetched once; pages are fetched concurrently with retries.
+
+    In incremental mode (the default, see CONFLUENCE_CONFIG["incremental_sync"]) only the
+    version numbers are fetched first; bodies are downloaded only for pages whose version
+    differs from the stored one, and only the files of those pages are written.
+
+    The spaces and page trees in CRAWL_CONFIG are crawled as well (see confluence_crawler.py).
     """
     try:
-        # Get predefined pages from configuration
-        predefined_pages = get_predefined_pages()
+        config = get_config()
+        if incremental is None:
+            incremental = config["incremental_sync"]
+        # Get predefined pages from configuration, each page_id only once
+        predefined_pages = dedupe_pages(get_predefined_pages())
+        crawl_config = get_crawl_config()
+        crawl_ids = [crawl_id_for("space", key) for key in crawl_config["spaces"]] + \
+                    [crawl_id_for("page", key) for key in crawl_config["root_pages"]]
         
-        if not predefined_pages:
-            print("No predefined Confluence pages found in configuration.")
+        if not predefined_pages and not crawl_ids:
+            print("No predefined Confluence pages or crawls found in configuration.")
             return
         
-        # Initialize content string
-        all_content = ""
+        gateway = get_gateway()
+        if gateway is None:
+            print("❌ Missing Confluence API credentials in .env")
+            return None
         
-        print(f"Loading {len(predefined_pages)} Confluence pages...")
+        load_start = time.perf_counter()
+        fetch_options = {
+            "max_concurrency": config["max_concurrency"],
+            "max_retries": config["max_retries"],
+            "retry_delay": config["retry_delay"],
+        }
         
-        # Process each page
-        for i, page in enumerate(predefined_pages, 1):
+        pages_to_fetch = predefined_pages
+        if incremental:
+            stored_versions = memory.get_confluence_page_versions()
+            versions = load_pages_concurrently(
+                predefined_pages,
+                gateway.fetch_page_version,
+                **fetch_options
+            )
+            # Unknown, changed or unreachable pages get a full fetch; the rest is skipped entirely
+            pages_to_fetch = [
+                page for page, fetched in versions
+                if fetched["status"] != "succes"
+                or stored_versions.get(page["page_id"]) is None
+                or page_version(fetched["page"]) != stored_versions[page["page_id"]]
+            ]
+            print(f"🔎 {len(pages_to_fetch)} of {len(predefined_pages)} Confluence pages changed "
+                  f"(version check {time.perf_counter() - load_start:.2f}s)")
+        
+        print(f"Loading {len(pages_to_fetch)} Confluence pages "
+              f"(max {config['max_concurrency']} concurrent)...")
+        
+        results = load_pages_concurrently(
+            pages_to_fetch,
+            gateway.fetch_page,
+            **fetch_options
+        )
+        
+        # Store fetched pages in configuration order
+        errors = {}
+        for page, fetched in results:
             page_id = page["page_id"]
-            title = page["title"]
-            
-            print(f"Loading page {i}/{len(predefined_pages)}: {title} (ID: {page_id})")
-            
-            # Get page content using the regular function
-            result = get_confluence_page_content(page_id)
-            
-            if result.get("status") == "succes":
-                content = result.get("inhoud", "")
-                page_title = result.get("titel", title)
-                
-                # Add page content to the overall content
-                page_section = "\n" + "="*80 + "\n"
-                page_section += f"PAGE: {page_title}\n"
-                page_section += f"PAGE ID: {page_id}\n"
-                page_section += f"ORIGINAL TITLE: {title}\n"
-                page_section += "="*80 + "\n\n"
-                page_section += content
-                page_section += "\n\n" + "-"*80 + "\n"
-                
-                all_content += page_section
-                print(f"✅ Successfully loaded: {page_title}")
+            timing = f"{fetched['duration']:.2f}s, {fetched['attempts']} attempt(s)"
+            if fetched["status"] == "succes":
+                titel, _ = store_page(memory, page_id, fetched["page"])
+                print(f"✅ Successfully loaded: {titel} ({timing})")
             else:
-                error_msg = result.get("bericht", "Unknown error")
-                print(f"❌ Failed to load page {page_id}: {error_msg}")
-                
-                # Add error information to content
-                error_section = "\n" + "="*80 + "\n"
-                error_section += "ERROR LOADING PAGE\n"
-                error_section += f"PAGE ID: {page_id}\n"
-                error_section += f"ORIGINAL TITLE: {title}\n"
-                error_section += f"ERROR: {error_msg}\n"
-                error_section += "="*80 + "\n\n"
-                
-                all_content += error_section
-        
-        # Write content to file
-        output_file = os.path.join(os.path.dirname(__file__), "confluence_content.txt")
+                errors[page_id] = fetched["error"] or "Unknown error"
+                print(f"❌ Failed to load page {page_id}: {errors[page_id]} ({timing})")
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write("CONFLUENCE PAGES CONTENT\n")
-            f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Total pages in config: {len(predefined_pages)}\n")
-            f.write("="*80 + "\n\n")
-            f.write(all_content)
+        if results:
+            slowest = max(fetched["duration"] for _, fetched in results)
+            print(f"⏱️ Loaded {len(results)} pages in {time.perf_counter() - load_start:.2f}s "
+                  f"(slowest page {slowest:.2f}s)")
         
-        print(f"✅ All Confluence pages content saved to: {output_file}")
-        return output_file
+        refreshed = [page["page_id"] for page, fetched in results if fetched["status"] == "succes"]
+        pages = predefined_pages
+        if crawl_ids:
+            crawler = ConfluenceCrawler(memory, gateway)
+            for crawl_id, result in crawler.crawl(force=not incremental).items():
+                state = "" if result["complete"] else ", incomplete: resumes on the next sync"
+                print(f"🕸️ Crawl {crawl_id}: {result['listed']} pages, {result['stored']} stored, "
+                      f"{result['unchanged']} unchanged, {result['failed']} failed ({result['duration']:.2f}s{state})")
+            crawled = crawler.crawled_pages(crawl_ids)
+            pages = dedupe_pages(predefined_pages + [
+                {"page_id": page_id, "title": title or f"Confluence pagina {page_id}"}
+                for page_id, title, _ in crawled
+            ])
+            refreshed += [page_id for page_id, _, changed in crawled if changed]
+        changed = sync_page_store(pages, refreshed, errors)
+        print(f"✅ Confluence pages saved to {page_store.directory} ({changed} file(s) changed)")
+        return page_store.directory
         
     except Exception as e:
         print(f"❌ Error loading Confluence pages: {str(e)}")
         return None
 
+def sync_page_store(pages, refreshed=(), errors=None):
+    """
+    Bring the page store in line with the configured pages: pages in refreshed or not yet
+    in the store are written from their normalized content in the database, pages that
+    are not stored get an error entry, and pages no longer configured are removed.
+    Returns the number of changed pages.
+    """
+    errors = errors or {}
+    refreshed = set(refreshed)
+    versions = memory.get_confluence_page_versions()
+    changed = 0
+    with page_store.batch():
+        for page in pages:
+            page_id = page["page_id"]
+            if page_id not in refreshed and page_store.has(page_id):
+                continue
+            cached = memory.get_cached_confluence_page(page_id)
+            if cached is not None:
+                changed += page_store.put(
+                    page_id, cached["title"], cached["content"],
+                    version=versions.get(page_id), original_title=page["title"]
+                )
+            else:
+                changed += page_store.put_error(page_id, page["title"], errors.get(page_id, "Unknown error"))
+        changed += page_store.retain(page["page_id"] for page in pages)
+    return changed
+
+_PAGE_HEADER_RE = re.compile(
+    r"^={80}\nPAGE: (?P<title>.*)\nPAGE ID: (?P<page_id>.*)\nORIGINAL TITLE: .*\n={80}\n\n",
+    re.MULTILINE
+)
+
+def parse_confluence_content(confluence_content):
+    """
+    Split the contents of the legacy confluence_content.txt back into (page_id, title, content) tuples.
+    """
+    pages = []
+    matches = list(_PAGE_HEADER_RE.finditer(confluence_content))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(confluence_content)
+        content = confluence_content[match.end():end]
+        content = content.rstrip().removesuffix("-"*80).strip()
+        pages.append((match.group("page_id").strip(), match.group("title").strip(), content))
+    return pages
+
+def import_legacy_content_file():
+    """
+    Move the pages of an old confluence_content.txt into the empty page store, once.
+    The file holds storage-format bodies; like sync_page_store, the store gets the
+    normalized content the database makes of them.
+    """
+    with open(confluence_content_file, 'r', encoding='utf-8') as f:
+        pages = parse_confluence_content(f.read())
+    memory.add_confluence_pages(((page_id, title, content, None) for page_id, title, content in pages), fetched=False)
+    with page_store.batch():
+        for page_id, title, content in pages:
+            page_store.put(page_id, title, memory.get_normalized_content(page_id) or content)
+    print(f"✅ Imported {len(pages)} pages from {confluence_content_file} into {page_store.directory}")
+
 def load_confluence_content_to_memory():
     """
-    Load the confluence_content.txt file into the agent's memory so it has access to all
-    the confluence content before starting conversations.
+    Load the page store into the agent's memory so it has access to all the confluence
+    content before starting conversations. Only pages the database does not have yet
+    are read from disk and added. The manifest the database was loaded from is kept as
+    knowledge snapshot; when the store still has that manifest, nothing is read at all.
     """
-    confluence_file = os.path.join(os.path.dirname(__file__), "confluence_content.txt")
-    
-    if not os.path.exists(confluence_file):
-        print("❌ confluence_content.txt not found. Loading Confluence pages first...")
-        load_all_confluence_pages()
+    if not page_store.page_ids():
+        if os.path.exists(confluence_content_file):
+            import_legacy_content_file()
+        else:
+            print("❌ Page store is empty. Loading Confluence pages first...")
+            load_all_confluence_pages()
     
     try:
-        with open(confluence_file, 'r', encoding='utf-8') as f:
-            confluence_content = f.read()
-        
-        # Store the confluence content in memory with a special key
-        memory.add_message("system", f"CONFLUENCE KNOWLEDGE BASE:\n{confluence_content}")
-        print(f"✅ Loaded confluence content into agent memory ({len(confluence_content)} characters)")
+        manifest = page_store.manifest_text()
+        version, loaded_manifest = memory.get_knowledge_snapshot()
+        if loaded_manifest == manifest:
+            print(f"✅ Confluence content unchanged since the last load (snapshot version {version})")
+            return True
+
+        stored = memory.get_confluence_page_versions()
+        added = 0
+        # Make sure every page in the store is stored as a page, so it can be retrieved per section
+        for page_id in page_store.page_ids():
+            if page_id in stored:
+                continue
+            page = page_store.read_page(page_id)
+            if page is None:
+                continue
+            title, content = page
+            memory.add_confluence_page(page_id, title, content, fetched=False)
+            added += 1
+
+        # The manifest this database now holds every page of; stored once per distinct state
+        version = memory.save_knowledge_snapshot(manifest)
+        print(f"✅ Loaded confluence content into agent memory "
+              f"({len(page_store.page_ids())} pages, {added} new, snapshot version {version})")
         return True
         
     except Exception as e:
@@ -170,97 +327,176 @@ def initialize_agent_with_confluence():
     
     print("✅ Agent initialized with Confluence knowledge")
 
-# Create a tool instance for the specific Confluence page
-# confluence_api_101_tool = haal_confluence_pagina_op("API+101+Understanding+APIs+and+API+Management")
-
-# Initialize agent with confluence knowledge
-initialize_agent_with_confluence()
-
-# Create the first agent (pro-regulation)
-agent_researcher = Agent(
-    name="Researcher",
-    #instructions="You are a diligent and objective researcher with expertise in gathering, analyzing, and synthesizing information from credible sources. you will make frequent use of the intenet search tool to verify your answers When the user asks a question, you should use the tools provided to you to find the answer. Your task is to provide well-researched, balanced, and evidence-based insights on complex topics. Focus on presenting relevant facts, recent studies, and multiple perspectives without taking a personal stance.",
-    instructions=f"""You are a helpful assistant that can use tools to complete tasks.
+AGENT_INSTRUCTIONS = """You are a helpful assistant that can use tools to complete tasks.
     You keep working on a task until either you have a question or clarification for the user, or the success criteria is met.
     You have many tools to help you, including tools to browse the internet, navigating and retrieving web pages.
     You have a tool to run python code, but note that you would need to include a print() statement if you wanted to receive output.
-    You have access to a comprehensive knowledge base of Confluence pages that has been loaded into your memory.
-    When answering questions, you can reference this knowledge base to provide accurate and detailed information.
-    The current date and time is {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}""",
-    model="gpt-4o-mini",
-    tools=[
-
-        kennisbank_opslaan,
-        kennisbank_zoeken,
-        haal_confluence_pagina_op    # Just the function reference
-    ]
-)
+    You have access to a comprehensive knowledge base of Confluence pages. The sections most relevant to each question are included with the question.
+    When answering questions, you can reference these excerpts to provide accurate and detailed information, and fetch a full page by its PAGE ID when an excerpt is not enough.
+    The current date and time is {now}"""
+
+def create_agent():
+    """Create the researcher agent with the knowledge base tools."""
+    from agents import Agent
+    
+    return Agent(
+        name="Researcher",
+        #instructions="You are a diligent and objective researcher with expertise in gathering, analyzing, and synthesizing information from credible sources. you will make frequent use of the intenet search tool to verify your answers When the user asks a question, you should use the tools provided to you to find the answer. Your task is to provide well-researched, balanced, and evidence-based insights on complex topics. Focus on presenting relevant facts, recent studies, and multiple perspectives without taking a personal stance.",
+        instructions=AGENT_INSTRUCTIONS.format(now=datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        model="gpt-4o-mini",
+        tools=get_tools(
+
+            kennisbank_opslaan,
+            kennisbank_zoeken,
+            confluence_semantisch_zoeken,
+            haal_confluence_pagina_op    # Just the function reference
+        )
+    )
+
+def startup(load_confluence=True):
+    """
+    Load .env, open the database (one SQLiteMemory shared with the agent tools) and
+    create the agent. With load_confluence the knowledge base is loaded as well,
+    which may call Confluence. Safe to call more than once.
+    """
+    global memory, retriever, context_builder, answer_cache, page_store, agent_researcher
+    if agent_researcher is not None:
+        return
+    start = time.perf_counter()
+    from dotenv import load_dotenv
+    # Load environment variables (make sure your .env has OPENAI_API_KEY)
+    load_dotenv(override=True)
+    
+    # Chat messages are written through group commits; get_history() flushes them first.
+    # Set AGENT_MULTI_PROCESS=1 when several app workers share the database file.
+    multi_process = os.environ.get("AGENT_MULTI_PROCESS", "").lower() in ("1", "true", "yes")
+    memory = SQLiteMemory(db_path, buffered_writes=True, multi_process=multi_process)
+    init_agent_tools(memory)
+    retriever = KnowledgeRetriever(memory)
+    context_builder = ContextBuilder(memory, retriever)
+    answer_cache = AnswerCache(memory)
+    page_store = PageStore(confluence_pages_dir)
+    agent_researcher = create_agent()
+    
+    elapsed = time.perf_counter() - start
+    marker = "✅" if elapsed <= COLD_START_BUDGET else "⚠️"
+    print(f"{marker} Startup took {elapsed:.2f}s (budget {COLD_START_BUDGET:.1f}s)")
+    
+    if load_confluence:
+        # Initialize agent with confluence knowledge
+        initialize_agent_with_confluence()
+
+def create_app(load_confluence=True):
+    """
+    Application factory: run startup() and return the Gradio chat interface.
+    Database maintenance and the metrics endpoint are started here, so workers
+    that only import the module never start background threads.
+    """
+    startup(load_confluence)
+    # Retention, summaries and compaction of the memory table on a schedule
+    memory.start_maintenance()
+    if memory.multi_process:
+        # Other workers' readers can keep SQLite's automatic checkpoints from finishing
+        memory.start_checkpoints()
+    metrics_config = get_metrics_config()
+    if metrics_config["enabled"] and metrics_config["serve"]:
+        # With several workers only the first one to start serves its metrics on the port
+        if start_metrics_server() is not None:
+            print(f"📈 Metrics on http://{metrics_config['host']}:{metrics_config['port']}/metrics")
+    return gr.ChatInterface(chat, type="messages")
 
 def run_agent_sync(agent, message):
     """Synchronous wrapper for Runner.run()"""
+    from agents import Runner
+    
     return asyncio.run(Runner.run(agent, message))
 
-def chat(message, history):
-    # Store user message
-    memory.add_message("user", message)
-    
-    # Get confluence knowledge from memory - search ALL messages, not just last 10
-    confluence_knowledge = ""
-    all_messages = memory.get_history(limit=1000)  # Get all messages to find confluence knowledge
-    for role, msg in all_messages:
-        if role == "system" and "CONFLUENCE KNOWLEDGE BASE:" in msg:
-            confluence_knowledge = msg
-            break
+def build_contextual_message(message, session_id=None):
+    """
+    Combine the knowledge base sections relevant to the message, the stored facts and
+    the recent conversation of the session into the prompt for the agent, within the
+    token budgets of CONTEXT_CONFIG. Logs the token breakdown of the prompt.
+    """
+    prompt, report = context_builder.build(message, session_id, instructions=agent_researcher.instructions)
+    print(f"🧮 Prompt {format_report(report)}")
+    return prompt
+
+def called_tools(result):
+    """True when the agent run called any tool."""
+    return any(item.type == "tool_call_item" for item in result.new_items)
+
+async def chat(message, history, request: "gr.Request" = None):
+    """
+    Async generator for gr.ChatInterface: runs on Gradio's event loop and yields the
+    answer as it is generated. The final answer is stored once the stream completes.
+    Every stage is a timing span (chat.*), see metrics.py.
+    """
+    from agents import Runner, trace
+    from openai.types.responses import ResponseTextDeltaEvent
     
-    # Retrieve last 10 messages for conversation context (excluding system messages)
-    history_messages = memory.get_history(limit=10)
-    # Format history as a string, excluding system messages
-    conversation_history = []
-    for role, msg in history_messages:
-        if role != "system":  # Exclude system messages from conversation history
-            conversation_history.append(f"{role}: {msg}")
-    history_str = "\n".join(conversation_history)
+    # Every browser session gets its own conversation; Gradio fills in the request
+    session_id = request.session_hash if request is not None else None
     
-    # Prepend confluence knowledge and history to the user message
-    contextual_message = f"{confluence_knowledge}\n\nConversation history:\n{history_str}\nUser: {message}"
-    with trace("personal assistant"):
-        result = run_agent_sync(agent_researcher, contextual_message)
-    # Store agent response
-    memory.add_message("agent", result.final_output)
-    return result.final_output
+    with span("chat.total"):
+        # Database work and retrieval run in a worker thread so the event loop stays free
+        with span("chat.store_user_message"):
+            # Only the opening question of a conversation is cacheable; later turns
+            # ("tell me more") depend on this session's history
+            context_free = not await asyncio.to_thread(memory.has_history, session_id)
+            await asyncio.to_thread(memory.add_message, "user", message, session_id=session_id)
+        
+        # Repeated questions are answered from the cache without a model call
+        if context_free:
+            with span("chat.answer_cache_lookup"):
+                cached = await asyncio.to_thread(answer_cache.get, message)
+            if cached is not None:
+                registry.increment("answer_cache_hits")
+                with span("chat.store_answer"):
+                    await asyncio.to_thread(memory.add_message, "agent", cached, session_id=session_id)
+                yield cached
+                return
+            registry.increment("answer_cache_misses")
+        
+        with span("chat.build_context"):
+            contextual_message = await asyncio.to_thread(build_contextual_message, message, session_id)
+        
+        with span("chat.agent_run"), trace("personal assistant"):
+            start = time.perf_counter()
+            result = Runner.run_streamed(agent_researcher, contextual_message)
+            partial = ""
+            async for event in result.stream_events():
+                if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    if not partial:
+                        registry.observe("chat.first_token", time.perf_counter() - start)
+                    partial += event.data.delta
+                    yield partial
+        
+        # Text of intermediate turns (before tool calls) is replaced by the final answer
+        answer = str(result.final_output)
+        with span("chat.store_answer"):
+            await asyncio.to_thread(memory.add_message, "agent", answer, session_id=session_id)
+            # A run with tool calls may have written (kennisbank_opslaan) or fetched live
+            # data; replaying its answer would skip those calls
+            if context_free and not called_tools(result):
+                await asyncio.to_thread(answer_cache.put, message, answer)
+        yield answer
 
 def main():
     # Initialize agent with confluence knowledge
-    initialize_agent_with_confluence()
+    startup()
     
     prompt = input("Enter your question for the agent: ")
     memory.add_message("user", prompt)
     
-    # Get confluence knowledge from memory - search ALL messages, not just last 10
-    confluence_knowledge = ""
-    all_messages = memory.get_history(limit=1000)  # Get all messages to find confluence knowledge
-    for role, msg in all_messages:
-        if role == "system" and "CONFLUENCE KNOWLEDGE BASE:" in msg:
-            confluence_knowledge = msg
-            break
-    
-    # Retrieve last 10 messages for conversation context (excluding system messages)
-    history_messages = memory.get_history(limit=10)
-    # Format history as a string, excluding system messages
-    conversation_history = []
-    for role, msg in history_messages:
-        if role != "system":  # Exclude system messages from conversation history
-            conversation_history.append(f"{role}: {msg}")
-    history_str = "\n".join(conversation_history)
-    
-    contextual_prompt = f"{confluence_knowledge}\n\nConversation history:\n{history_str}\nUser: {prompt}"
+    contextual_prompt = build_contextual_message(prompt)
     result = run_agent_sync(agent_researcher, contextual_prompt)
     print(result)
-    memory.add_message("agent", result)
+    memory.add_message("agent", result.final_output)
     print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
 def test_load_confluence_pages():
     """Test function to load all Confluence pages without running the full application."""
+    startup(load_confluence=False)
     print("Testing Confluence pages loading...")
     result = load_all_confluence_pages()
     if result:
@@ -268,6 +504,21 @@ def test_load_confluence_pages():
     else:
         print("❌ Test failed.")
 
+def test_metrics_server():
+    """Test function: a second worker starting the metrics endpoint on a taken port must not fail."""
+    from urllib.request import urlopen
+    first = start_metrics_server(port=0)
+    port = first.server_address[1]
+    try:
+        second = start_metrics_server(port=port)
+        assert second is None, "second metrics server should not bind the same port"
+        with urlopen(f"http://{first.server_address[0]}:{port}/metrics", timeout=5) as response:
+            assert response.status == 200
+        print(f"✅ Test completed successfully. Metrics served once on port {port}.")
+    finally:
+        first.shutdown()
+        first.server_close()
+
 if __name__ == "__main__":
     # Uncomment the next line to use the CLI
     # main()
@@ -275,5 +526,5 @@ if __name__ == "__main__":
     # Uncomment the next line to test Confluence pages loading
     # test_load_confluence_pages()
     
-    gr.ChatInterface(chat, type="messages").launch()
+    create_app().launch()
     
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Offline benchmarks for the context-build, search and persistence hot paths.
+
+Every run builds a synthetic database in a temporary directory (the size is set
+by --scale), times each hot path several times and writes the results as JSON.
+The medians are compared with benchmark_baseline.json; a benchmark that got
+slower than the baseline by more than --tolerance fails the run (exit code 1).
+The agent runner and the Confluence client are stubbed, so no network is used;
+the replay benchmark serves recorded pages through confluence_transport.py.
+
+    python benchmarks.py                      # small scale, compare with the baseline
+    python benchmarks.py --scale medium --output results.json
+    python benchmarks.py --save-baseline      # store the results as the new baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Absolute slack on top of --tolerance, so scheduler jitter on sub-millisecond paths is not a regression
+NOISE_FLOOR_MS = 0.5
+
+# Simulated server time per Confluence call in the replay benchmark (seconds)
+REPLAY_LATENCY = 0.005
+
+# Crawled pages, memory rows, Confluence pages and kennis rows per scale
+SCALES = {
+    "small": {"crawl_pages": 200, "memory_rows": 1_000, "sessions": 10, "pages": 10, "kennis_rows": 100, "iterations": 50},
+    "medium": {"crawl_pages": 5_000, "memory_rows": 100_000, "sessions": 1_000, "pages": 1_000, "kennis_rows": 10_000, "iterations": 20},
+    "large": {"crawl_pages": 50_000, "memory_rows": 1_000_000, "sessions": 10_000, "pages": 10_000, "kennis_rows": 100_000, "iterations": 10},
+}
+
+WORDS = (
+    "api key gateway token incident priority oauth client secret portal subscription "
+    "product policy rate limit backend endpoint certificate consumer provider team "
+    "monitoring alert escalation deployment environment sandbox production request "
+    "response header version documentation onboarding access approval owner"
+).split()
+
+QUESTIONS = [
+    "How do I get my API keys?",
+    "How do I raise an incident?",
+    "What is the rate limit of the gateway?",
+    "Who approves access to a production API?",
+    "How do I rotate a client secret?",
+]
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_page(rng, sections=4):
+    """A page body in Confluence storage format with headings, paragraphs and a list."""
+    parts = []
+    for i in range(sections):
+        parts.append(f"<h2>{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}</h2>")
+        parts.append("<p>" + " ".join(_sentence(rng) for _ in range(4)) + "</p>")
+        parts.append("<ul>" + "".join(f"<li>{_sentence(rng, 6)}</li>" for _ in range(3)) + "</ul>")
+    return "".join(parts)
+
+
+class StubConfluence:
+    """
+    Confluence client answering from synthetic pages: every space has space_pages
+    pages and every page has fanout children, down to depth levels below a root.
+    """
+
+    def __init__(self, seed=0, space_pages=0, fanout=0, depth=0):
+        self.seed = seed
+        self.space_pages = space_pages
+        self.fanout = fanout
+        self.depth = depth
+
+    @staticmethod
+    def _summary(page_id):
+        return {"id": page_id, "title": f"Page {page_id}", "version": {"number": 1}}
+
+    def get_all_pages_from_space(self, space, start=0, limit=50, expand=None):
+        return [self._summary(f"{space}-{i}") for i in range(start, min(start + limit, self.space_pages))]
+
+    def get_page_child_by_type(self, page_id, type="page", start=0, limit=50, expand=None):
+        if str(page_id).count(".") >= self.depth:
+            return []
+        return [self._summary(f"{page_id}.{i}") for i in range(self.fanout)][start:start + limit]
+
+    def get_page_by_id(self, page_id, expand=None):
+        rng = random.Random(f"{self.seed}:{page_id}")
+        page = {"id": page_id, "title": f"Page {page_id}", "version": {"number": 1}}
+        if expand and "body.storage" in expand:
+            page["body"] = {"storage": {"value": synthetic_page(rng)}}
+        return page
+
+
+def populate(memory, scale, rng):
+    """Fill a fresh database: pages through add_confluence_page, bulk rows for memory and kennis."""
+    from agent_tools import init_kennisbank
+
+    for i in range(scale["pages"]):
+        memory.add_confluence_page(f"{1000 + i}", f"Page {1000 + i}", synthetic_page(rng), version=1)
+    init_kennisbank(memory)
+    now = datetime.now().isoformat()
+    with memory.connection() as conn:
+        conn.executemany(
+            "INSERT INTO memory (timestamp, role, message, session_id) VALUES (?, ?, ?, ?)",
+            (
+                (now, "user" if i % 2 == 0 else "agent", _sentence(rng, 20), f"session-{i % scale['sessions']}")
+                for i in range(scale["memory_rows"])
+            )
+        )
+        conn.executemany(
+            "INSERT INTO kennis (onderwerp, inhoud) VALUES (?, ?)",
+            ((rng.choice(WORDS), _sentence(rng, 30)) for _ in range(scale["kennis_rows"]))
+        )
+
+
+def timed(fn, iterations):
+    """Run fn iterations times; return median, p95 and min in milliseconds."""
+    samples = []
+    for i in range(iterations):
+        # The app's progress messages would dominate the output
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn(i)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "min_ms": round(samples[0], 4),
+        "iterations": iterations,
+    }
+
+
+def import_time(iterations=5):
+    """Cold import of app.py in a fresh interpreter (see COLD_START_BUDGET in app.py)."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    return timed(
+        lambda i: subprocess.run([sys.executable, "-c", code], cwd=root, check=True, capture_output=True),
+        iterations
+    )
+
+
+def run_benchmarks(scale_name, seed=42):
+    import app
+    import agent_tools
+    from answer_cache import AnswerCache
+    from confluence_crawler import ConfluenceCrawler
+    from confluence_gateway import ConfluenceGateway, set_gateway
+    from confluence_transport import FixtureStore, RecordingClient, ReplayClient
+    from context_builder import ContextBuilder
+    from page_store import PageStore
+    from retrieval import KnowledgeRetriever
+    from sqlite_memory import SQLiteMemory
+
+    scale = SCALES[scale_name]
+    iterations = scale["iterations"]
+    rng = random.Random(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = SQLiteMemory(os.path.join(tmp, "bench.db"))
+        populate(memory, scale, rng)
+
+        # The app's module state as startup() would set it, with a stub instead of the agent
+        app.memory = memory
+        app.retriever = KnowledgeRetriever(memory)
+        app.context_builder = ContextBuilder(memory, app.retriever)
+        app.answer_cache = AnswerCache(memory)
+        app.agent_researcher = SimpleNamespace(instructions=app.AGENT_INSTRUCTIONS.format(now="now"))
+        app.page_store = PageStore(os.path.join(tmp, "confluence_pages"))
+        app.confluence_content_file = os.path.join(tmp, "confluence_content.txt")
+        agent_tools.init_agent_tools(memory)
+
+        results["import_app"] = import_time()
+        results["get_history"] = timed(
+            lambda i: memory.get_history(10, f"session-{i % scale['sessions']}"), iterations
+        )
+        results["search_confluence_pages"] = timed(
+            lambda i: memory.search_confluence_pages(QUESTIONS[i % len(QUESTIONS)]), iterations
+        )
+        results["kennisbank_zoeken"] = timed(
+            lambda i: agent_tools.kennisbank_zoeken(QUESTIONS[i % len(QUESTIONS)]), iterations
+        )
+        results["add_confluence_page_new"] = timed(
+            lambda i: memory.add_confluence_page(f"new-{i}", f"New {i}", synthetic_page(rng)), iterations
+        )
+        results["add_confluence_page_unchanged"] = timed(
+            lambda i: memory.add_confluence_page("1000", "Page 1000", memory.get_confluence_page_by_id("1000")[2]),
+            iterations
+        )
+
+        def rebuild_context(i):
+            # Forget the retrieval index so every call pays for the first build
+            app.retriever._index = None
+            app.build_contextual_message(QUESTIONS[i % len(QUESTIONS)], "session-0")
+
+        results["context_first_build"] = timed(rebuild_context, max(3, iterations // 5))
+        results["context_build"] = timed(
+            lambda i: app.build_contextual_message(QUESTIONS[i % len(QUESTIONS)], f"session-{i % scale['sessions']}"),
+            iterations
+        )
+        results["answer_cache_lookup"] = timed(
+            lambda i: app.answer_cache.get(QUESTIONS[i % len(QUESTIONS)]), iterations
+        )
+
+        pages = [{"page_id": f"{1000 + i}", "title": f"Page {1000 + i}", "description": ""}
+                 for i in range(scale["pages"])]
+        set_gateway(ConfluenceGateway(client=StubConfluence(seed)))
+        app.get_predefined_pages = lambda: pages
+        results["load_all_confluence_pages"] = timed(
+            lambda i: app.load_all_confluence_pages(incremental=False), max(3, iterations // 5)
+        )
+        results["load_confluence_content_to_memory"] = timed(
+            lambda i: app.load_confluence_content_to_memory(), max(3, iterations // 5)
+        )
+
+        # A space of crawl_pages pages; after the first pass only the listings are fetched
+        crawl_gateway = ConfluenceGateway(client=StubConfluence(seed, space_pages=scale["crawl_pages"]))
+        crawler = ConfluenceCrawler(memory, crawl_gateway)
+        results["crawl_space"] = timed(lambda i: crawler.crawl(spaces=["BENCH"]), max(3, iterations // 5))
+
+        # Record the stub pages once, then replay them with a fixed latency per call
+        store = FixtureStore(os.path.join(tmp, "fixtures"))
+        recorder = RecordingClient(StubConfluence(seed), store)
+        for page in pages:
+            recorder.get_page_by_id(page["page_id"], expand="body.storage,version")
+        set_gateway(ConfluenceGateway(client=ReplayClient(store, latency=REPLAY_LATENCY, seed=seed)))
+        results["load_all_confluence_pages_replay"] = timed(
+            lambda i: app.load_all_confluence_pages(incremental=False), max(3, iterations // 5)
+        )
+        set_gateway(None)
+        memory.close()
+
+    return {
+        "scale": scale_name,
+        "sizes": {key: value for key, value in scale.items() if key != "iterations"},
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "timestamp": datetime.now().isoformat(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the names of benchmarks whose median is slower than baseline * (1 + tolerance)."""
+    regressions = []
+    print(f"\n{'benchmark':36} {'median ms':>12} {'baseline ms':>12} {'change':>8}")
+    for name, result in report["results"].items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:36} {result['median_ms']:>12.3f} {'-':>12} {'new':>8}")
+            continue
+        change = (result["median_ms"] - base["median_ms"]) / base["median_ms"] if base["median_ms"] else 0.0
+        # Noise below NOISE_FLOOR_MS never counts as a regression
+        slower = result["median_ms"] > base["median_ms"] * (1 + tolerance) + NOISE_FLOOR_MS
+        marker = "  <-- REGRESSION" if slower else ""
+        print(f"{name:36} {result['median_ms']:>12.3f} {base['median_ms']:>12.3f} {change:>+8.0%}{marker}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline for this scale")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.scale)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[args.scale] = report
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"✅ Baseline for scale '{args.scale}' saved to {args.baseline}")
+        return 0
+
+    if args.scale not in baselines:
+        print(f"⚠️ No baseline for scale '{args.scale}'; run with --save-baseline first")
+        compare(report, {}, args.tolerance)
+        return 0
+    regressions = compare(report, baselines[args.scale]["results"], args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) slower than the baseline: {', '.join(regressions)}")
+        return 1
+    print("\n✅ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Compression of Confluence page bodies for the confluence_blobs table.
+
+Bodies are zlib-compressed, optionally with a preset dictionary. Storage-format
+markup repeats the same tags and macro attributes on every page, so a
+dictionary built from those fragments (train_dictionary) lets even short pages
+compress well. zlib is in the standard library, so there is no extra dependency.
+"""
+import re
+import zlib
+from collections import Counter
+
+COMPRESSION_LEVEL = 9
+
+# Upper bound of a trained dictionary; zlib only uses the last 32 KB of it
+DICTIONARY_SIZE = 32 * 1024
+
+# Markup fragments a dictionary is built from: tags (with attributes) and entities
+_FRAGMENT_RE = re.compile(r"</?[a-zA-Z][^<>]{0,200}>|&[a-zA-Z]+;")
+
+
+def compress(text, dictionary=None):
+    """zlib-compressed UTF-8 of text, using dictionary (bytes) as preset when given."""
+    if dictionary:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress(data, dictionary=None):
+    """Inverse of compress(); dictionary must be the one the data was compressed with."""
+    if dictionary:
+        decompressor = zlib.decompressobj(zdict=dictionary)
+    else:
+        decompressor = zlib.decompressobj()
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    Preset dictionary from sample bodies: the markup fragments that occur on the
+    most samples, most common last (zlib reaches the end of the dictionary with
+    the shortest distances). Returns bytes, empty when the samples have no markup.
+    """
+    document_frequency = Counter()
+    for sample in samples:
+        document_frequency.update(set(_FRAGMENT_RE.findall(sample)))
+    fragments = []
+    total = 0
+    for fragment, count in document_frequency.most_common():
+        if count < 2:
+            break
+        encoded = fragment.encode("utf-8")
+        if total + len(encoded) > size:
+            continue
+        fragments.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(fragments))
@@ -52,7 +52,87 @@ CONFLUENCE_CONFIG = {
     "check_existing_pages": True,  # Controleer of pagina's al bestaan voordat ze geladen worden
     "verbose_logging": True,       # Toon gedetailleerde logging tijdens het laden
     "max_retries": 3,             # Maximum aantal pogingen per pagina
-    "retry_delay": 2,             # Wachtijd tussen pogingen in seconden
+    "retry_delay": 2,             # Wachtijd tussen pogingen in seconden (verdubbelt per poging, met jitter)
+    "max_concurrency": 4,         # Maximum aantal pagina's dat tegelijk wordt opgehaald
+    "incremental_sync": True,     # Alleen pagina's met een nieuw versienummer opnieuw downloaden
+    "pool_size": 8,               # Keep-alive verbindingen in de gedeelde Confluence-sessie (minstens max_concurrency)
+    "connect_timeout": 5,         # Seconden voor het opzetten van een verbinding
+    "read_timeout": 30,           # Seconden wachten op een antwoord van Confluence
+    "page_cache_ttl": 900,        # Seconden dat een opgeslagen pagina als vers geldt voor haal_confluence_pagina_op
+    "page_cache_max_stale": 86400,  # Tot deze leeftijd wordt een verouderde kopie direct gebruikt en op de achtergrond ververst
+}
+
+# Retrieval opties: alleen de meest relevante secties gaan mee in de prompt
+RETRIEVAL_CONFIG = {
+    "top_k": 5,                   # Maximum aantal secties per vraag
+    "max_context_chars": 6000,    # Totaal budget (in tekens) voor kennisbank-context
+    "chunk_chars": 1500,          # Maximale grootte van een sectie-chunk
+    "bm25_k1": 1.5,               # BM25 term-frequentie verzadiging
+    "bm25_b": 0.75,               # BM25 lengte-normalisatie
+}
+
+# Semantische index: gehashte TF-IDF vectoren per sectie, als memory-mapped matrix naast de database
+VECTOR_INDEX_CONFIG = {
+    "dimensions": 4096,           # Aantal hash-buckets (kolommen van de matrix)
+    "char_ngrams": 3,             # Lengte van de letter-n-grammen naast hele woorden (0 = uit)
+    "top_k": 5,                   # Aantal resultaten per vraag
+    "min_score": 0.02,            # Minimale cosinus-gelijkenis
+    "block_rows": 8192,           # Aantal rijen per blok bij het doorzoeken van de matrix
+}
+
+# Prompt-budget in tokens: secties met de laagste prioriteit worden eerst ingekort
+CONTEXT_CONFIG = {
+    "model": "gpt-4o-mini",       # Bepaalt de tokenizer (tiktoken), anders een schatting van 4 tekens per token
+    "max_prompt_tokens": 6000,    # Totaal budget voor instructies, vraag, kennis, geschiedenis en feiten
+    "history_messages": 10,       # Maximum aantal berichten uit de gespreksgeschiedenis
+    "section_budgets": {          # Budget per sectie (de vraag zelf wordt nooit ingekort)
+        "instructions": 1000,
+        "knowledge": 3000,
+        "history": 1500,
+        "facts": 300,
+    },
+    # Volgorde van belangrijk naar minst belangrijk; bij overschrijding wordt achteraan begonnen
+    "priority": ["instructions", "question", "knowledge", "history", "facts"],
+}
+
+# Lokale metrics: tijdmetingen per stap, te lezen via http://host:port/metrics (Prometheus)
+METRICS_CONFIG = {
+    "enabled": True,              # Zet op False om geen tijdmetingen bij te houden
+    "serve": True,                # Start het /metrics endpoint bij create_app()
+    "host": "127.0.0.1",
+    "port": 9464,
+    "window": 2048,               # Aantal recente metingen per span voor p50/p95/p99
+    "json_log_path": None,        # Pad voor een JSON-lines log van elke span (None = uit)
+}
+
+# Antwoord-cache: herhaalde vragen worden zonder model-aanroep beantwoord
+ANSWER_CACHE_CONFIG = {
+    "enabled": True,              # Zet op False om de cache uit te schakelen
+    "ttl_seconds": 7 * 24 * 3600, # Maximale leeftijd van een antwoord
+    "max_entries": 1000,          # Maximum aantal antwoorden; de minst recent gebruikte vallen eerst af
+}
+
+# Crawler: hele spaces of pagina-bomen inlezen naast de voorgedefinieerde pagina's
+CRAWL_CONFIG = {
+    "spaces": [],                 # Space keys waarvan alle pagina's worden ingelezen, bv. ["APIDOCS"]
+    "root_pages": [],             # Page ids waarvan de pagina en alle onderliggende pagina's worden ingelezen
+    "page_size": 50,              # Aantal resultaten per API-aanroep bij het opvragen van een lijst pagina's
+    "batch_size": 50,             # Aantal pagina's per transactie (en maximaal tegelijk in het geheugen)
+    "max_concurrency": 4,         # Maximum aantal gelijktijdige API-aanroepen
+}
+
+# Transport voor Confluence-aanroepen: "live", "record" (antwoorden opslaan als fixtures) of
+# "replay" (offline afspelen, voor belastingstests). De omgevingsvariabele CONFLUENCE_TRANSPORT gaat voor.
+TRANSPORT_CONFIG = {
+    "mode": "live",
+    "fixtures_dir": "./confluence_fixtures",  # Opgenomen pagina's als <page_id>/<versie>.json
+    "latency": 0.0,               # Replay: vertraging per aanroep in seconden
+    "jitter": 0.0,                # Replay: willekeurige afwijking van de vertraging (+/- seconden)
+    "error_rate": 0.0,            # Replay: kans op een gesimuleerde fout per aanroep
+    "throttle_rate": 0.0,         # Replay: kans op een gesimuleerde 429 Too Many Requests
+    "retry_after": 1.0,           # Replay: Retry-After in seconden bij een 429
+    "max_concurrent": None,       # Replay: meer gelijktijdige aanroepen dan dit krijgen een 429 (None = geen limiet)
+    "seed": 0,                    # Replay: vaste seed zodat een run reproduceerbaar is
 }
 
 CONFLUENCE_PAGES_DIR = "./confluence_pages"  # Update this path as needed
@@ -68,6 +148,34 @@ def get_config():
     """Haal de configuratie op."""
     return CONFLUENCE_CONFIG
 
+def get_retrieval_config():
+    """Haal de retrieval configuratie op."""
+    return RETRIEVAL_CONFIG
+
+def get_vector_index_config():
+    """Haal de configuratie van de semantische index op."""
+    return VECTOR_INDEX_CONFIG
+
+def get_context_config():
+    """Haal de configuratie van het prompt-budget op."""
+    return CONTEXT_CONFIG
+
+def get_metrics_config():
+    """Haal de configuratie van de metrics op."""
+    return METRICS_CONFIG
+
+def get_answer_cache_config():
+    """Haal de configuratie van de antwoord-cache op."""
+    return ANSWER_CACHE_CONFIG
+
+def get_crawl_config():
+    """Haal de configuratie van de crawler op."""
+    return CRAWL_CONFIG
+
+def get_transport_config():
+    """Haal de configuratie van het Confluence-transport op."""
+    return TRANSPORT_CONFIG
+
 def add_predefined_page(page_id: str, title: str, description: str = ""):
     """Voeg een nieuwe voorgedefinieerde pagina toe aan de lijst."""
     new_page = {
@@ -0,0 +1,252 @@
+"""
+Crawling whole Confluence spaces and page trees into the database.
+
+A crawl starts from space keys (every page in the space) and/or root page IDs
+(the page and all its descendants). Listings are fetched one page of results
+at a time with version metadata only, so unchanged pages are skipped without
+downloading their bodies. Changed pages are fetched in batches with bounded
+concurrency and written with SQLiteMemory.add_confluence_pages, one
+transaction per batch; at most one batch of bodies is held in memory.
+
+The frontier lives in the crawl_tasks and crawl_pages tables of the same
+database, so an interrupted crawl resumes where it stopped. A crawl whose
+previous pass finished starts a new pass.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from confluence_config import get_config, get_crawl_config
+from confluence_gateway import page_version
+from confluence_loader import fetch_with_retry, load_pages_concurrently
+
+
+def crawl_id_for(kind, key):
+    """Name of the crawl of one space ("space:KEY") or page tree ("page:ID")."""
+    return f"{kind}:{key}"
+
+
+class ConfluenceCrawler:
+    """Resumable crawler writing into a SQLiteMemory through a ConfluenceGateway."""
+
+    def __init__(self, memory, gateway, config=None, loader_config=None):
+        self.memory = memory
+        self.gateway = gateway
+        self.config = config or get_crawl_config()
+        loader_config = loader_config or get_config()
+        self.fetch_options = {
+            "max_concurrency": self.config["max_concurrency"],
+            "max_retries": loader_config["max_retries"],
+            "retry_delay": loader_config["retry_delay"],
+        }
+        with self.memory.connection() as conn:
+            # Listings still to fetch: all pages of a space, or the children of one page
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_tasks (
+                    crawl_id TEXT,
+                    kind TEXT,
+                    key TEXT,
+                    start INTEGER DEFAULT 0,
+                    done INTEGER DEFAULT 0,
+                    PRIMARY KEY (crawl_id, kind, key)
+                )
+            """)
+            # Pages found by a crawl; status is pending, stored, unchanged or failed
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_pages (
+                    crawl_id TEXT,
+                    page_id TEXT,
+                    title TEXT,
+                    version INTEGER,
+                    status TEXT,
+                    error TEXT,
+                    PRIMARY KEY (crawl_id, page_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_crawl_pages_status ON crawl_pages(crawl_id, status)")
+
+    def crawl(self, spaces=(), root_pages=(), force=False):
+        """
+        Crawl the given spaces and page trees (default: CRAWL_CONFIG). With force every
+        page body is downloaded, also when its version is unchanged. Returns a summary
+        with the number of listed, stored, unchanged and failed pages per crawl.
+        """
+        if not spaces and not root_pages:
+            spaces, root_pages = self.config["spaces"], self.config["root_pages"]
+        summary = {}
+        for kind, keys in (("space", spaces), ("page", root_pages)):
+            for key in keys:
+                crawl_id = crawl_id_for(kind, key)
+                start = time.perf_counter()
+                self._start_pass(crawl_id, kind, key)
+                complete = self._run(crawl_id, force)
+                summary[crawl_id] = {**self._counts(crawl_id), "complete": complete,
+                                     "duration": round(time.perf_counter() - start, 2)}
+        return summary
+
+    def _start_pass(self, crawl_id, kind, key):
+        """Seed a new pass unless an unfinished one can be resumed."""
+        with self.memory.connection() as conn:
+            started = conn.execute("SELECT 1 FROM crawl_tasks WHERE crawl_id = ? LIMIT 1", (crawl_id,)).fetchone()
+            unfinished = conn.execute(
+                "SELECT 1 FROM crawl_tasks WHERE crawl_id = ? AND done = 0 "
+                "UNION ALL SELECT 1 FROM crawl_pages WHERE crawl_id = ? AND status = 'pending' LIMIT 1",
+                (crawl_id, crawl_id)
+            ).fetchone()
+            if started and unfinished:
+                print(f"↩️ Resuming crawl {crawl_id}")
+                return
+            conn.execute("DELETE FROM crawl_tasks WHERE crawl_id = ?", (crawl_id,))
+            conn.execute("DELETE FROM crawl_pages WHERE crawl_id = ?", (crawl_id,))
+            if kind == "space":
+                conn.execute("INSERT INTO crawl_tasks (crawl_id, kind, key) VALUES (?, 'space', ?)", (crawl_id, key))
+            else:
+                # The root itself has no listed version, so its body is always fetched
+                conn.execute(
+                    "INSERT INTO crawl_pages (crawl_id, page_id, status) VALUES (?, ?, 'pending')", (crawl_id, key)
+                )
+                conn.execute("INSERT INTO crawl_tasks (crawl_id, kind, key) VALUES (?, 'children', ?)", (crawl_id, key))
+
+    def _list(self, kind, key, start):
+        limit = self.config["page_size"]
+        if kind == "space":
+            return self.gateway.list_space_pages(key, start, limit)
+        return self.gateway.list_child_pages(key, start, limit)
+
+    def _run(self, crawl_id, force):
+        """Alternate listing rounds with full batches of bodies; returns False when listings keep failing."""
+        limit = self.config["page_size"]
+        workers = self.fetch_options["max_concurrency"]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="confluence-crawler") as pool:
+            while True:
+                with self.memory.connection() as conn:
+                    tasks = conn.execute(
+                        "SELECT kind, key, start FROM crawl_tasks WHERE crawl_id = ? AND done = 0 LIMIT ?",
+                        (crawl_id, workers)
+                    ).fetchall()
+                if not tasks:
+                    break
+                # fetch_with_retry treats a falsy result as "not found"; an empty listing is a valid answer
+                futures = [
+                    pool.submit(
+                        fetch_with_retry,
+                        lambda key, kind=kind, start=start: {"items": self._list(kind, key, start)},
+                        key,
+                        self.fetch_options["max_retries"],
+                        self.fetch_options["retry_delay"],
+                    )
+                    for kind, key, start in tasks
+                ]
+                progress = False
+                with self.memory.connection() as conn:
+                    for (kind, key, start), future in zip(tasks, futures):
+                        result = future.result()
+                        if result["status"] != "succes":
+                            print(f"❌ Listing {kind} {key} (from {start}) failed: {result['error']}")
+                            continue
+                        progress = True
+                        items = result["page"]["items"]
+                        for item in items:
+                            conn.execute(
+                                "INSERT OR IGNORE INTO crawl_pages (crawl_id, page_id, title, version, status) "
+                                "VALUES (?, ?, ?, ?, 'pending')",
+                                (crawl_id, str(item["id"]), item.get("title"), page_version(item))
+                            )
+                            if kind == "children":
+                                # Walk the tree: every child gets its own children listing
+                                conn.execute(
+                                    "INSERT OR IGNORE INTO crawl_tasks (crawl_id, kind, key) VALUES (?, 'children', ?)",
+                                    (crawl_id, str(item["id"]))
+                                )
+                        conn.execute(
+                            "UPDATE crawl_tasks SET start = ?, done = ? WHERE crawl_id = ? AND kind = ? AND key = ?",
+                            (start + len(items), len(items) < limit, crawl_id, kind, key)
+                        )
+                if not progress:
+                    # Every listing failed even after retries; the next run resumes here
+                    self._fetch_pending(crawl_id, force, minimum=1)
+                    return False
+                self._fetch_pending(crawl_id, force, minimum=self.config["batch_size"])
+        self._fetch_pending(crawl_id, force, minimum=1)
+        return True
+
+    def _fetch_pending(self, crawl_id, force, minimum):
+        """Store pending pages batch by batch while at least minimum of them are waiting."""
+        batch_size = self.config["batch_size"]
+        while True:
+            with self.memory.connection() as conn:
+                rows = conn.execute(
+                    "SELECT page_id, title, version FROM crawl_pages WHERE crawl_id = ? AND status = 'pending' LIMIT ?",
+                    (crawl_id, batch_size)
+                ).fetchall()
+            if not rows or len(rows) < minimum:
+                return
+            stored = {} if force else self.memory.get_confluence_page_versions(row[0] for row in rows)
+            unchanged = [row[0] for row in rows if row[2] is not None and stored.get(row[0]) == row[2]]
+            skip = set(unchanged)
+            results = load_pages_concurrently(
+                [{"page_id": row[0]} for row in rows if row[0] not in skip],
+                self.gateway.fetch_page,
+                **self.fetch_options
+            )
+            fetched = [fetched for _, fetched in results if fetched["status"] == "succes"]
+            self.memory.add_confluence_pages(
+                (
+                    f["page_id"],
+                    f["page"].get("title", f"Confluence pagina {f['page_id']}"),
+                    f["page"]["body"]["storage"]["value"],
+                    page_version(f["page"]),
+                )
+                for f in fetched
+            )
+            with self.memory.connection() as conn:
+                conn.executemany(
+                    "UPDATE crawl_pages SET status = 'unchanged' WHERE crawl_id = ? AND page_id = ?",
+                    ((crawl_id, page_id) for page_id in unchanged)
+                )
+                conn.executemany(
+                    "UPDATE crawl_pages SET status = ?, title = ?, version = ?, error = ? WHERE crawl_id = ? AND page_id = ?",
+                    (
+                        (
+                            "stored" if f["status"] == "succes" else "failed",
+                            f["page"].get("title") if f["page"] else None,
+                            page_version(f["page"]) if f["page"] else None,
+                            f["error"],
+                            crawl_id,
+                            f["page_id"],
+                        )
+                        for _, f in results
+                    )
+                )
+
+    def _counts(self, crawl_id):
+        with self.memory.connection() as conn:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM crawl_pages WHERE crawl_id = ? GROUP BY status", (crawl_id,)
+            ).fetchall())
+        return {
+            "listed": sum(counts.values()),
+            "stored": counts.get("stored", 0),
+            "unchanged": counts.get("unchanged", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+        }
+
+    def crawled_pages(self, crawl_ids=None):
+        """
+        (page_id, title, changed) of every page a crawl stored or found unchanged, in
+        crawl order; changed is True for pages whose body was written in the last pass.
+        """
+        with self.memory.connection() as conn:
+            if crawl_ids is None:
+                rows = conn.execute(
+                    "SELECT page_id, title, status FROM crawl_pages WHERE status IN ('stored', 'unchanged') ORDER BY rowid"
+                )
+            else:
+                crawl_ids = list(crawl_ids)
+                placeholders = ", ".join("?" * len(crawl_ids))
+                rows = conn.execute(
+                    f"SELECT page_id, title, status FROM crawl_pages WHERE crawl_id IN ({placeholders}) "
+                    "AND status IN ('stored', 'unchanged') ORDER BY rowid",
+                    crawl_ids
+                )
+            return [(page_id, title, status == "stored") for page_id, title, status in rows]
@@ -0,0 +1,163 @@
+"""
+One shared Confluence client for the bulk loader and the agent tools.
+
+ConfluenceGateway wraps an atlassian Confluence client on a requests session
+with a keep-alive connection pool, so consecutive and concurrent fetches reuse
+open TLS connections instead of doing a handshake per page. get_gateway()
+returns the process-wide instance, created on first use from the credentials
+in .env; pool size and timeouts come from CONFLUENCE_CONFIG. Underneath, the
+transport from confluence_transport.py can record or replay the responses.
+"""
+import os
+import threading
+
+from confluence_config import get_config
+from confluence_transport import is_replay, wrap_client
+from metrics import instrument_methods
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def page_version(pagina):
+    """Version number of a fetched page, or None when the page has no version info."""
+    return (pagina.get("version") or {}).get("number")
+
+
+def store_page(memory, page_id, pagina):
+    """
+    Store a page fetched with its body in memory (a SQLiteMemory) and return
+    (title, content), the content normalized once per version.
+    """
+    content = pagina["body"]["storage"]["value"]
+    title = pagina.get("title", f"Confluence pagina {page_id}")
+    memory.add_confluence_page(page_id, title, content, version=page_version(pagina))
+    return title, memory.get_normalized_content(page_id) or content
+
+
+def create_session(pool_size, connect_timeout, read_timeout):
+    """A requests session whose connection pool holds pool_size keep-alive connections per host."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class _PooledAdapter(HTTPAdapter):
+        # atlassian passes a single timeout; apply separate connect and read timeouts instead
+        def send(self, request, **kwargs):
+            kwargs["timeout"] = (connect_timeout, read_timeout)
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    # Retries are done by confluence_loader with backoff, not by urllib3
+    adapter = _PooledAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ConfluenceGateway:
+    """
+    Page fetches through one pooled Confluence client.
+
+    Pass client to use an existing object with get_page_by_id (e.g. a stub in
+    benchmarks); otherwise a Confluence client is built for url and credentials.
+    Safe to use from several threads at once.
+    """
+
+    def __init__(self, url=None, username=None, password=None, config=None, client=None):
+        self.config = config or get_config()
+        self.session = None
+        if client is None:
+            from atlassian import Confluence
+            self.session = create_session(
+                self.config["pool_size"], self.config["connect_timeout"], self.config["read_timeout"]
+            )
+            client = Confluence(
+                url=url,
+                username=username,
+                password=password,
+                session=self.session,
+                timeout=self.config["read_timeout"]
+            )
+        self.client = client
+
+    def fetch_page(self, page_id):
+        """
+        Fetch a page including its storage-format body and version.
+        Returns None when the page has no body; API errors are raised so callers can retry.
+        """
+        pagina = self.client.get_page_by_id(page_id, expand="body.storage,version")
+        if pagina and "body" in pagina and "storage" in pagina["body"]:
+            return pagina
+        return None
+
+    def fetch_and_store(self, page_id, memory):
+        """
+        fetch_page followed by store_page: the one fetch path of the loader and the agent
+        tools. Returns (title, normalized content), or None when the page has no body.
+        """
+        pagina = self.fetch_page(page_id)
+        if pagina is None:
+            return None
+        return store_page(memory, page_id, pagina)
+
+    def fetch_page_version(self, page_id):
+        """
+        Fetch only the version metadata of a page (no body).
+        Returns None when the page does not exist; API errors are raised so callers can retry.
+        """
+        pagina = self.client.get_page_by_id(page_id, expand="version")
+        if pagina and "version" in pagina:
+            return pagina
+        return None
+
+    def list_space_pages(self, space_key, start=0, limit=50):
+        """One page of results of all pages in a space, with version metadata but no bodies."""
+        return list(self.client.get_all_pages_from_space(
+            space_key, start=start, limit=limit, expand="version"
+        ) or [])
+
+    def list_child_pages(self, page_id, start=0, limit=50):
+        """One page of results of the direct child pages of a page, with version metadata but no bodies."""
+        return list(self.client.get_page_child_by_type(
+            page_id, type="page", start=start, limit=limit, expand="version"
+        ) or [])
+
+    def close(self):
+        """Close the pooled connections."""
+        if self.session is not None:
+            self.session.close()
+
+
+instrument_methods(ConfluenceGateway, "confluence", exclude=("close",))
+
+
+def get_gateway():
+    """
+    The shared gateway, created on first use from CONFLUENCE_BASE_URL, CONFLUENCE_EMAIL
+    and CONFLUENCE_API_TOKEN and the configured transport. Returns None when credentials
+    are missing (in replay mode no credentials are needed).
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            if is_replay():
+                _gateway = ConfluenceGateway(client=wrap_client(None))
+                return _gateway
+            url = os.environ.get("CONFLUENCE_BASE_URL")
+            email = os.environ.get("CONFLUENCE_EMAIL")
+            api_token = os.environ.get("CONFLUENCE_API_TOKEN")
+            if not url or not email or not api_token:
+                return None
+            gateway = ConfluenceGateway(url, email, api_token)
+            gateway.client = wrap_client(gateway.client)
+            _gateway = gateway
+        return _gateway
+
+
+def set_gateway(gateway):
+    """Replace the shared gateway (None closes it and builds a new one on the next get_gateway())."""
+    global _gateway
+    with _gateway_lock:
+        previous, _gateway = _gateway, gateway
+    if previous is not None and previous is not gateway:
+        previous.close()
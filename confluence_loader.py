@@ -0,0 +1,96 @@
+"""
+Concurrent loading of Confluence pages.
+
+Page ids are deduplicated, fetched through a bounded thread pool and retried
+with exponential backoff and jitter. Every result carries its own timing so
+slow pages are easy to spot.
+"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def dedupe_pages(pages):
+    """Keep the first entry for every page_id, preserving the configured order."""
+    seen = set()
+    unique = []
+    for page in pages:
+        if page["page_id"] in seen:
+            continue
+        seen.add(page["page_id"])
+        unique.append(page)
+    return unique
+
+
+def backoff_delay(attempt, retry_delay):
+    """Exponential backoff (retry_delay, 2x, 4x, ...) with +/-50% jitter."""
+    return retry_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def retry_after(error):
+    """Seconds the server asked to wait before retrying (Retry-After of a 429/503), or 0."""
+    value = getattr(error, "retry_after", None)
+    response = getattr(error, "response", None)
+    if value is None and response is not None:
+        value = (getattr(response, "headers", None) or {}).get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def fetch_with_retry(fetch, page_id, max_retries=3, retry_delay=2):
+    """
+    Call fetch(page_id) until it succeeds or max_retries attempts are used.
+
+    fetch returns the page (or None when it does not exist) and raises on
+    transient errors. Returns a result dict with status, page, error,
+    attempts and duration in seconds.
+    """
+    start = time.perf_counter()
+    attempts = 0
+    error = None
+    while attempts < max(1, max_retries):
+        attempts += 1
+        try:
+            page = fetch(page_id)
+            return {
+                "page_id": page_id,
+                "status": "succes" if page else "fout",
+                "page": page,
+                "error": None if page else f"Pagina met ID '{page_id}' niet gevonden.",
+                "attempts": attempts,
+                "duration": time.perf_counter() - start,
+            }
+        except Exception as e:
+            error = str(e)
+            if attempts < max_retries:
+                # A throttled request waits at least as long as the server asked
+                time.sleep(max(backoff_delay(attempts, retry_delay), retry_after(e)))
+    return {
+        "page_id": page_id,
+        "status": "fout",
+        "page": None,
+        "error": f"Fout bij ophalen Confluence-pagina: {error}",
+        "attempts": attempts,
+        "duration": time.perf_counter() - start,
+    }
+
+
+def load_pages_concurrently(pages, fetch, max_concurrency=4, max_retries=3, retry_delay=2):
+    """
+    Fetch all (deduplicated) pages with at most max_concurrency requests in flight.
+
+    Returns (page, result) pairs in configuration order, where result is the
+    dict produced by fetch_with_retry.
+    """
+    unique_pages = dedupe_pages(pages)
+    if not unique_pages:
+        return []
+    workers = max(1, min(max_concurrency, len(unique_pages)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="confluence-loader") as pool:
+        futures = [
+            pool.submit(fetch_with_retry, fetch, page["page_id"], max_retries, retry_delay)
+            for page in unique_pages
+        ]
+        return [(page, future.result()) for page, future in zip(unique_pages, futures)]
@@ -0,0 +1,237 @@
+"""
+Record and replay Confluence responses for offline load tests.
+
+The gateway fetches pages through a client with get_page_by_id (and lists
+spaces and child pages for the crawler). RecordingClient wraps the real client
+and writes every fetched page to a FixtureStore on disk, one JSON file per page
+ID and version, plus every page of listing results. ReplayClient answers from that store
+without any network and can inject latency, errors and throttling (HTTP 429
+with Retry-After). This makes loader concurrency, retries and the page cache
+reproducible on a disconnected machine.
+
+The mode is chosen with TRANSPORT_CONFIG["mode"] in confluence_config.py or
+the CONFLUENCE_TRANSPORT environment variable: live, record or replay.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from confluence_config import get_transport_config
+
+
+class TransportError(Exception):
+    """Injected transient error of the replay transport."""
+
+
+class ThrottledError(TransportError):
+    """Injected 429 Too Many Requests; retry_after is the requested wait in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"429 Too Many Requests (Retry-After: {retry_after}s)")
+        self.retry_after = retry_after
+
+
+def _safe_name(page_id):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(page_id))
+
+
+class FixtureStore:
+    """
+    Recorded pages as <directory>/<page_id>/<version>.json and page listings (of
+    spaces and child pages) as <directory>/_listings/<kind>-<key>-<start>-<limit>.json.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _page_dir(self, page_id):
+        return os.path.join(self.directory, _safe_name(page_id))
+
+    def save(self, page_id, pagina):
+        """Store a fetched page under its version number (0 when it has none)."""
+        version = (pagina.get("version") or {}).get("number") or 0
+        page_dir = self._page_dir(page_id)
+        path = os.path.join(page_dir, f"{version}.json")
+        with self._lock:
+            os.makedirs(page_dir, exist_ok=True)
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    existing = json.load(f)
+                # A version-only response must not replace a recorded body
+                if "body" in existing and "body" not in pagina:
+                    return path
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(pagina, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return path
+
+    def versions(self, page_id):
+        page_dir = self._page_dir(page_id)
+        if not os.path.isdir(page_dir):
+            return []
+        return sorted(int(name[:-5]) for name in os.listdir(page_dir) if re.fullmatch(r"\d+\.json", name))
+
+    def load(self, page_id, version=None):
+        """The recorded page at version (default: the newest), or None."""
+        versions = self.versions(page_id)
+        if not versions:
+            return None
+        if version is None:
+            version = versions[-1]
+        elif version not in versions:
+            return None
+        with open(os.path.join(self._page_dir(page_id), f"{version}.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _listing_path(self, kind, key, start, limit):
+        return os.path.join(self.directory, "_listings", f"{kind}-{_safe_name(key)}-{start}-{limit}.json")
+
+    def save_listing(self, kind, key, start, limit, items):
+        path = self._listing_path(kind, key, start, limit)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return path
+
+    def load_listing(self, kind, key, start, limit):
+        """A recorded listing, or None when this page of results was never recorded."""
+        path = self._listing_path(kind, key, start, limit)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def page_ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if self.versions(name))
+
+
+class RecordingClient:
+    """Pass-through to a live client that saves every returned page and listing in the store."""
+
+    def __init__(self, client, store):
+        self.client = client
+        self.store = store
+
+    def get_page_by_id(self, page_id, expand=None):
+        pagina = self.client.get_page_by_id(page_id, expand=expand)
+        if pagina:
+            self.store.save(page_id, pagina)
+        return pagina
+
+    def get_all_pages_from_space(self, space, start=0, limit=50, expand=None):
+        items = list(self.client.get_all_pages_from_space(space, start=start, limit=limit, expand=expand) or [])
+        self.store.save_listing("space", space, start, limit, items)
+        return items
+
+    def get_page_child_by_type(self, page_id, type="page", start=0, limit=50, expand=None):
+        items = list(self.client.get_page_child_by_type(
+            page_id, type=type, start=start, limit=limit, expand=expand
+        ) or [])
+        self.store.save_listing("children", page_id, start, limit, items)
+        return items
+
+
+class ReplayClient:
+    """
+    Serves recorded pages with injected faults.
+
+    latency (+/- jitter) seconds are slept per call; error_rate and throttle_rate
+    are the chances of a TransportError or ThrottledError. Throttling is also
+    applied when more than max_concurrent calls are in flight. Faults come
+    from a seeded random generator, so a run is reproducible for a given seed.
+    """
+
+    def __init__(self, store, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1.0, max_concurrent=None, seed=0):
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.calls = 0
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            return (
+                self._random.uniform(-self.jitter, self.jitter),
+                self._random.random(),
+                self._in_flight,
+            )
+
+    def _simulate(self, what):
+        """Sleep the injected latency and raise the injected fault, if any, for one call."""
+        jitter, roll, in_flight = self._draw()
+        try:
+            time.sleep(max(0.0, self.latency + jitter))
+            if (self.max_concurrent and in_flight > self.max_concurrent) or roll < self.throttle_rate:
+                raise ThrottledError(self.retry_after)
+            if roll < self.throttle_rate + self.error_rate:
+                raise TransportError(f"Injected error for {what}")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get_all_pages_from_space(self, space, start=0, limit=50, expand=None):
+        self._simulate(f"space {space}")
+        return self.store.load_listing("space", space, start, limit) or []
+
+    def get_page_child_by_type(self, page_id, type="page", start=0, limit=50, expand=None):
+        self._simulate(f"children of page {page_id}")
+        return self.store.load_listing("children", page_id, start, limit) or []
+
+    def get_page_by_id(self, page_id, expand=None):
+        self._simulate(f"page {page_id}")
+        pagina = self.store.load(page_id)
+        if pagina is None:
+            return None
+        if not (expand and "body.storage" in expand):
+            pagina.pop("body", None)
+        return pagina
+
+
+def wrap_client(client, config=None):
+    """
+    The client to use for the configured transport mode: client itself (live), a
+    RecordingClient around it (record) or a ReplayClient (replay, client is ignored).
+    """
+    config = config or get_transport_config()
+    mode = os.environ.get("CONFLUENCE_TRANSPORT") or config["mode"]
+    store = FixtureStore(config["fixtures_dir"])
+    if mode == "live":
+        return client
+    if mode == "record":
+        return RecordingClient(client, store)
+    if mode == "replay":
+        return ReplayClient(
+            store,
+            latency=config["latency"],
+            jitter=config["jitter"],
+            error_rate=config["error_rate"],
+            throttle_rate=config["throttle_rate"],
+            retry_after=config["retry_after"],
+            max_concurrent=config["max_concurrent"],
+            seed=config["seed"],
+        )
+    raise ValueError(f"Unknown Confluence transport mode: {mode}")
+
+
+def is_replay(config=None):
+    config = config or get_transport_config()
+    return (os.environ.get("CONFLUENCE_TRANSPORT") or config["mode"]) == "replay"
@@ -0,0 +1,267 @@
+"""
+Convert Confluence storage format (XHTML with ac:/ri: elements) to compact Markdown.
+
+Headings, lists, tables, code blocks and link texts are kept; macros that only
+carry presentation (table of contents, parameters, images, emoticons, local-ids,
+inline styles) are dropped.
+"""
+import re
+from html.parser import HTMLParser
+
+# Bump when the output format changes so stored conversions are redone
+NORMALIZER_VERSION = 1
+
+_STORAGE_FORMAT_RE = re.compile(r"<(/?(p|h[1-6]|ul|ol|li|table|div|span|br|pre|code|strong|em|a)\b|ac:|ri:)", re.IGNORECASE)
+
+# Elements whose content is never shown to the reader
+_SKIPPED_TAGS = {"ac:parameter", "ac:image", "ac:emoticon", "ac:placeholder", "style", "script", "ri:attachment"}
+# Macros that only render navigation or layout
+_SKIPPED_MACROS = {"toc", "children", "pagetree", "recently-updated", "contentbylabel", "anchor"}
+_PANEL_MACROS = {"info": "Info", "note": "Note", "warning": "Warning", "tip": "Tip"}
+_BLOCK_TAGS = {"p", "div", "blockquote", "ac:layout-cell", "ac:layout-section", "ac:rich-text-body"}
+
+
+def looks_like_storage_format(content):
+    """True when the content still contains storage-format markup."""
+    return bool(_STORAGE_FORMAT_RE.search(content))
+
+
+class _StorageFormatParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.buffers = [[]]       # Output stack; table cells capture into their own buffer
+        self.has_text = [False]   # Per buffer: has any non-whitespace been written
+        self.skip_depth = 0       # >0 while inside an element that is dropped
+        self.skip_stack = []
+        self.lists = []           # Stack of [list_type, item_counter]
+        self.macros = []          # Stack of [macro_name, params]
+        self.param_name = None
+        self.param_text = []
+        self.pre_depth = 0
+        self.table_rows = []
+        self.current_row = None
+        self.link_title = None    # ri:content-title of the ac:link being parsed
+        self.link_start = 0
+
+    # Output helpers
+
+    @property
+    def out(self):
+        return self.buffers[-1]
+
+    def write(self, text):
+        self.out.append(text)
+        if not self.has_text[-1] and text.strip():
+            self.has_text[-1] = True
+
+    def push_buffer(self):
+        self.buffers.append([])
+        self.has_text.append(False)
+
+    def pop_buffer(self):
+        self.has_text.pop()
+        return "".join(self.buffers.pop())
+
+    def newline(self, count=1):
+        """Make sure the output ends with at least `count` newlines."""
+        if not self.has_text[-1]:
+            return
+        text = "".join(self.out[-4:])
+        existing = len(text) - len(text.rstrip("\n"))
+        if existing < count:
+            self.write("\n" * (count - existing))
+
+    # Parser callbacks
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.skip_depth:
+            if tag not in ("br", "hr"):
+                self.skip_stack.append(tag)
+                self.skip_depth += 1
+            return
+
+        if tag == "ac:parameter" and self.macros:
+            self.param_name = attrs.get("ac:name")
+            self.param_text = []
+        if tag in _SKIPPED_TAGS:
+            self.skip_stack.append(tag)
+            self.skip_depth += 1
+            return
+
+        if tag == "ac:structured-macro":
+            name = attrs.get("ac:name", "")
+            if name in _SKIPPED_MACROS:
+                self.skip_stack.append(tag)
+                self.skip_depth += 1
+                return
+            self.macros.append([name, {}])
+            if name in _PANEL_MACROS:
+                self.newline(2)
+                self.write(f"**{_PANEL_MACROS[name]}:** ")
+            return
+
+        if re.fullmatch(r"h[1-6]", tag):
+            self.newline(2)
+            self.write("#" * int(tag[1]) + " ")
+        elif tag in _BLOCK_TAGS:
+            if not self.lists:
+                self.newline(2)
+        elif tag in ("ul", "ol"):
+            if not self.lists:
+                self.newline(2)
+            self.lists.append([tag, 0])
+        elif tag == "li":
+            self.newline(1)
+            if self.lists:
+                self.lists[-1][1] += 1
+                list_type, counter = self.lists[-1]
+                marker = f"{counter}. " if list_type == "ol" else "- "
+                self.write("  " * (len(self.lists) - 1) + marker)
+            else:
+                self.write("- ")
+        elif tag in ("br",):
+            self.write("\n")
+        elif tag == "pre":
+            self.newline(2)
+            self.write("```\n")
+            self.pre_depth += 1
+        elif tag == "code" and not self.pre_depth:
+            self.write("`")
+        elif tag in ("strong", "b"):
+            self.write("**")
+        elif tag == "table":
+            self.newline(2)
+            self.table_rows = []
+        elif tag == "tr":
+            self.current_row = []
+        elif tag in ("td", "th"):
+            self.push_buffer()
+        elif tag == "time" and attrs.get("datetime"):
+            self.write(attrs["datetime"])
+        elif tag == "ri:page" and attrs.get("ri:content-title"):
+            # Used as link text when the ac:link has no body of its own
+            self.link_title = attrs["ri:content-title"]
+        elif tag == "ac:link":
+            self.link_title = None
+            self.link_start = len(self.out)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "hr", "ri:page", "ri:user", "ri:url", "time"):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.skip_depth:
+            if self.skip_stack and self.skip_stack[-1] == tag:
+                self.skip_stack.pop()
+                self.skip_depth -= 1
+                if tag == "ac:parameter" and self.param_name and self.macros:
+                    self.macros[-1][1][self.param_name] = "".join(self.param_text).strip()
+                    self.param_name = None
+            return
+
+        if tag == "ac:structured-macro":
+            if self.macros:
+                name, params = self.macros.pop()
+                if name == "status" and params.get("title"):
+                    self.write(f"[{params['title']}]")
+                elif name in _PANEL_MACROS:
+                    self.newline(2)
+            return
+
+        if re.fullmatch(r"h[1-6]", tag) or tag in _BLOCK_TAGS:
+            if not self.lists:
+                self.newline(2)
+        elif tag in ("ul", "ol"):
+            if self.lists:
+                self.lists.pop()
+            self.newline(1 if self.lists else 2)
+        elif tag == "pre":
+            self.newline(1)
+            self.write("```")
+            self.newline(2)
+            self.pre_depth = max(0, self.pre_depth - 1)
+        elif tag == "code" and not self.pre_depth:
+            self.write("`")
+        elif tag in ("strong", "b"):
+            self.write("**")
+        elif tag in ("td", "th"):
+            cell = self.pop_buffer() if len(self.buffers) > 1 else ""
+            cell = re.sub(r"\s+", " ", cell).strip().replace("|", "\\|")
+            if self.current_row is not None:
+                self.current_row.append(cell)
+        elif tag == "tr":
+            if self.current_row is not None:
+                self.table_rows.append(self.current_row)
+            self.current_row = None
+        elif tag == "table":
+            self.write_table()
+        elif tag == "ac:link":
+            if self.link_title and not "".join(self.out[self.link_start:]).strip():
+                self.write(self.link_title)
+            self.link_title = None
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            if self.param_name is not None:
+                self.param_text.append(data)
+            return
+        if self.pre_depth:
+            self.write(data)
+            return
+        text = re.sub(r"\s+", " ", data)
+        if not "".join(self.out[-1:]).strip() or self.out[-1].endswith(("\n", " ")):
+            text = text.lstrip()
+        self.write(text)
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> holds the body of code macros
+        if data.startswith("CDATA[") and not self.skip_depth:
+            body = data[len("CDATA["):]
+            if self.macros and self.macros[-1][0] in ("code", "noformat"):
+                language = self.macros[-1][1].get("language", "")
+                self.newline(2)
+                self.write(f"```{language}\n{body.rstrip()}\n```")
+                self.newline(2)
+            else:
+                self.write(body)
+
+    def write_table(self):
+        rows = [row for row in self.table_rows if any(row)]
+        self.table_rows = []
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        lines = []
+        for i, row in enumerate(rows):
+            row = row + [""] * (width - len(row))
+            lines.append("| " + " | ".join(row) + " |")
+            if i == 0:
+                lines.append("|" + " --- |" * width)
+        self.newline(2)
+        self.write("\n".join(lines))
+        self.newline(2)
+
+    def result(self):
+        text = "".join(self.buffers[0])
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip()
+
+
+def normalize_storage_format(content):
+    """
+    Convert Confluence storage format to compact Markdown.
+
+    Content without storage-format markup (for example text that was already
+    normalized) is returned unchanged apart from surrounding whitespace.
+    """
+    if not content:
+        return ""
+    if not looks_like_storage_format(content):
+        return content.strip()
+    parser = _StorageFormatParser()
+    parser.feed(content)
+    parser.close()
+    return parser.result()
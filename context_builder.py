@@ -0,0 +1,139 @@
+"""
+Token-budgeted prompt assembly.
+
+The prompt consists of sections (instructions, question, knowledge, history,
+facts). Each section is filled up to its own token budget; when the total
+still exceeds max_prompt_tokens, content is removed from the lowest-priority
+section first. Tokens are counted with tiktoken when it is installed and
+estimated at four characters per token otherwise.
+"""
+from confluence_config import get_context_config
+from retrieval import KNOWLEDGE_HEADER, format_chunk
+
+_CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """Counts and truncates text in tokens of the configured model."""
+
+    def __init__(self, model):
+        self.encoding = None
+        # Imported here so importing this module stays cheap
+        try:
+            import tiktoken
+        except ImportError:
+            tiktoken = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+    def truncate(self, text, max_tokens):
+        """Keep the first max_tokens tokens of text."""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+
+
+class ContextBuilder:
+    """
+    Builds the agent prompt for a question from the relevant knowledge base
+    excerpts, the session history and the stored facts within token budgets.
+    """
+
+    def __init__(self, memory, retriever, config=None):
+        self.memory = memory
+        self.retriever = retriever
+        self.config = config or get_context_config()
+        self.counter = TokenCounter(self.config["model"])
+
+    def _fit(self, items, budget):
+        """Take items (most important first) while they fit; the first one is truncated if needed."""
+        kept, used = [], 0
+        for item in items:
+            tokens = self.counter.count(item)
+            if used + tokens > budget:
+                item = self.counter.truncate(item, budget) if not kept else ""
+                if item:
+                    kept.append(item)
+                    used = self.counter.count(item)
+                break
+            kept.append(item)
+            used += tokens
+        return kept, used
+
+    def build(self, message, session_id=None, instructions=""):
+        """
+        Return (prompt, report). The report maps every section to its token count
+        and has the total, the budget and the number of dropped items per section.
+        Instructions are sent separately as the agent's system prompt; they are only counted.
+        """
+        budgets = self.config["section_budgets"]
+        candidates = {
+            "knowledge": [format_chunk(chunk) for chunk in self.retriever.retrieve(message)],
+            # Newest first, so the oldest messages are dropped first
+            "history": [
+                f"{role}: {msg}"
+                for role, msg in reversed(self.memory.get_history(self.config["history_messages"], session_id))
+                if role != "system"
+            ],
+            "facts": [f"{key}: {value}" for key, value in self.memory.get_all_facts().items()],
+        }
+        sections, tokens = {}, {
+            "instructions": self.counter.count(instructions),
+            "question": self.counter.count(message),
+        }
+        for name, items in candidates.items():
+            sections[name], tokens[name] = self._fit(items, budgets.get(name, 0))
+
+        # Over the total budget: shrink the lowest-priority sections first
+        max_total = self.config["max_prompt_tokens"]
+        for name in reversed(self.config["priority"]):
+            if sum(tokens.values()) <= max_total:
+                break
+            if name not in sections:
+                continue
+            excess = sum(tokens.values()) - max_total
+            sections[name], tokens[name] = self._fit(sections[name], max(0, tokens[name] - excess))
+
+        parts = []
+        if sections["knowledge"]:
+            parts.append(KNOWLEDGE_HEADER + "\n\n".join(sections["knowledge"]))
+        if sections["facts"]:
+            parts.append("Known facts:\n" + "\n".join(sections["facts"]))
+        history_str = "\n".join(reversed(sections["history"]))
+        parts.append(f"Conversation history:\n{history_str}\nUser: {message}")
+        prompt = "\n\n".join(parts)
+
+        report = dict(tokens)
+        report["total"] = sum(tokens.values())
+        report["budget"] = max_total
+        report["dropped"] = {
+            name: len(candidates[name]) - len(sections[name])
+            for name in candidates if len(candidates[name]) > len(sections[name])
+        }
+        if tokens["instructions"] > budgets.get("instructions", max_total):
+            report["warning"] = "instructions exceed their budget"
+        return prompt, report
+
+
+def format_report(report):
+    """One-line summary of a build() report for logging."""
+    sections = ", ".join(
+        f"{name} {report[name]}" for name in ("instructions", "question", "knowledge", "history", "facts")
+    )
+    line = f"{report['total']}/{report['budget']} tokens ({sections})"
+    if report["dropped"]:
+        line += " dropped " + ", ".join(f"{count} {name}" for name, count in report["dropped"].items())
+    return line
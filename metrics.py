@@ -0,0 +1,207 @@
+"""
+Local instrumentation: timing spans, counters and a metrics endpoint.
+
+span("name") times a block and records its duration; timed("name") does the
+same for a function. Per span name the registry keeps call and error counters
+and a sliding window of recent durations for p50/p95/p99. start_metrics_server()
+serves them in Prometheus text format on /metrics (and as JSON on
+/metrics.json); every span can also be appended to a JSON-lines log file.
+"""
+import errno
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from confluence_config import get_metrics_config
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "ht_agent"
+
+
+class _SpanStats:
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+
+class MetricsRegistry:
+    """Thread-safe store of span durations and named counters."""
+
+    def __init__(self, config=None):
+        self.config = config or get_metrics_config()
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def observe(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = _SpanStats(self.config["window"])
+            stats.count += 1
+            stats.total += seconds
+            stats.recent.append(seconds)
+            if error:
+                stats.errors += 1
+        log_path = self.config["json_log_path"]
+        if log_path:
+            line = json.dumps({
+                "timestamp": datetime.now().isoformat(),
+                "span": name,
+                "duration_ms": round(seconds * 1000, 3),
+                "error": error,
+            })
+            with self._log_lock, open(log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Counters and per-span count, errors, sum and quantiles (in seconds)."""
+        with self._lock:
+            spans = {
+                name: (stats.count, stats.errors, stats.total, sorted(stats.recent))
+                for name, stats in self._spans.items()
+            }
+            counters = dict(self._counters)
+        result = {"counters": counters, "spans": {}}
+        for name, (count, errors, total, recent) in sorted(spans.items()):
+            result["spans"][name] = {
+                "count": count,
+                "errors": errors,
+                "sum": total,
+                "quantiles": {
+                    str(q): recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.0
+                    for q in QUANTILES
+                },
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def prometheus_text(self):
+        """The snapshot in Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        duration = f"{METRIC_PREFIX}_span_duration_seconds"
+        lines = [
+            f"# HELP {duration} Duration of instrumented spans (quantiles over the last calls).",
+            f"# TYPE {duration} summary",
+        ]
+        for name, stats in snapshot["spans"].items():
+            label = _escape(name)
+            for q, value in stats["quantiles"].items():
+                lines.append(f'{duration}{{span="{label}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{duration}_sum{{span="{label}"}} {stats["sum"]:.6f}')
+            lines.append(f'{duration}_count{{span="{label}"}} {stats["count"]}')
+        errors = f"{METRIC_PREFIX}_span_errors_total"
+        lines += [f"# HELP {errors} Spans that ended with an exception.", f"# TYPE {errors} counter"]
+        for name, stats in snapshot["spans"].items():
+            lines.append(f'{errors}{{span="{_escape(name)}"}} {stats["errors"]}')
+        for name, value in sorted(snapshot["counters"].items()):
+            counter = f"{METRIC_PREFIX}_{_metric_name(name)}_total"
+            lines += [f"# TYPE {counter} counter", f"{counter} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as span name; exceptions are counted and re-raised."""
+    if not registry.config["enabled"]:
+        yield
+        return
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except GeneratorExit:
+        # A closed stream (e.g. the client went away) is not an error of the span
+        raise
+    except BaseException:
+        error = True
+        raise
+    finally:
+        registry.observe(name, time.perf_counter() - start, error)
+
+
+def timed(name):
+    """Decorator that runs the function inside span(name)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls, prefix, exclude=()):
+    """Wrap every public method of cls in a span named prefix.method."""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or attr in exclude or not callable(value):
+            continue
+        setattr(cls, attr, timed(f"{prefix}.{attr}")(value))
+    return cls
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = registry.prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(registry.snapshot(), indent=2).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the console
+        pass
+
+
+def start_metrics_server(host=None, port=None):
+    """
+    Serve /metrics and /metrics.json in a background thread; returns the server. When
+    the address is taken (another app worker serves it already) None is returned.
+    """
+    config = registry.config
+    address = (host or config["host"], config["port"] if port is None else port)
+    try:
+        server = ThreadingHTTPServer(address, _MetricsHandler)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        print(f"⚠️ Metrics endpoint {address[0]}:{address[1]} is already served by another process")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
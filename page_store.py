@@ -0,0 +1,190 @@
+"""
+Per-page file store for the normalized Confluence pages.
+
+Every page body is written once as objects/<hash[:2]>/<hash>.md, named by the
+SHA-256 of its content, so an unchanged page is never rewritten and identical
+pages share one file. manifest.json maps page_id to title, content hash,
+version and (for pages that could not be loaded) the error. All writes go to a
+temp file that is renamed into place, so readers never see a half-written file.
+Pages are read one at a time: read_page() for a single page, open_page() to
+stream one body and iter_pages() to walk the store without loading it all.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+
+
+def atomic_write(path, data):
+    """Write data (str) to path via a temp file in the same directory and a rename."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PageStore:
+    """Content-addressed page files plus a manifest in directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.RLock()
+        self._pages = None
+        self._batch_depth = 0
+        self._dirty = False
+
+    # Manifest
+
+    def _manifest(self):
+        if self._pages is None:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, encoding="utf-8") as f:
+                    self._pages = json.load(f)["pages"]
+            else:
+                self._pages = {}
+        return self._pages
+
+    def _changed(self):
+        self._dirty = True
+        if self._batch_depth == 0:
+            self._save_manifest()
+
+    def _save_manifest(self):
+        atomic_write(self.manifest_path, self.manifest_text())
+        self._dirty = False
+
+    def manifest_text(self):
+        """The manifest as stored on disk; equal text means an equal store."""
+        with self._lock:
+            return json.dumps({"pages": self._manifest()}, ensure_ascii=False, indent=1, sort_keys=True)
+
+    @contextmanager
+    def batch(self):
+        """Write the manifest once at the end of the block instead of after every change."""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self._save_manifest()
+
+    # Pages
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.directory, "objects", content_hash[:2], f"{content_hash}.md")
+
+    def put(self, page_id, title, content, version=None, original_title=None):
+        """Store a page; returns True when its file or manifest entry changed."""
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        path = self._object_path(content_hash)
+        with self._lock:
+            entry = self._manifest().get(page_id)
+            if (entry and entry.get("content_hash") == content_hash and entry["title"] == title
+                    and entry.get("version") == version and entry.get("original_title") == original_title):
+                return False
+            if not os.path.exists(path):
+                atomic_write(path, content)
+            old_hash = entry.get("content_hash") if entry else None
+            self._manifest()[page_id] = {
+                "title": title,
+                "original_title": original_title,
+                "content_hash": content_hash,
+                "version": version,
+                "updated": datetime.now().isoformat(),
+            }
+            self._changed()
+            if old_hash and old_hash != content_hash:
+                self._remove_unused_object(old_hash)
+        return True
+
+    def put_error(self, page_id, title, error):
+        """Record that a page could not be loaded; an already stored body is kept."""
+        with self._lock:
+            entry = self._manifest().get(page_id)
+            if entry and entry.get("content_hash"):
+                return False
+            if entry and entry.get("error") == error:
+                return False
+            self._manifest()[page_id] = {
+                "title": title,
+                "original_title": title,
+                "error": error,
+                "updated": datetime.now().isoformat(),
+            }
+            self._changed()
+        return True
+
+    def has(self, page_id):
+        with self._lock:
+            entry = self._manifest().get(page_id)
+            return bool(entry and entry.get("content_hash"))
+
+    def entry(self, page_id):
+        """The manifest entry of a page (a copy), or None."""
+        with self._lock:
+            entry = self._manifest().get(page_id)
+            return dict(entry) if entry else None
+
+    def page_ids(self):
+        with self._lock:
+            return list(self._manifest())
+
+    def open_page(self, page_id):
+        """Open the body of a page for streaming reads; raises KeyError when it has none."""
+        entry = self.entry(page_id)
+        if not entry or not entry.get("content_hash"):
+            raise KeyError(page_id)
+        return open(self._object_path(entry["content_hash"]), encoding="utf-8")
+
+    def read_page(self, page_id):
+        """(title, content) of one page, or None when it is not stored."""
+        entry = self.entry(page_id)
+        if not entry or not entry.get("content_hash"):
+            return None
+        with open(self._object_path(entry["content_hash"]), encoding="utf-8") as f:
+            return entry["title"], f.read()
+
+    def iter_pages(self):
+        """Yield (page_id, title, content) for every stored page, reading one file at a time."""
+        for page_id in self.page_ids():
+            page = self.read_page(page_id)
+            if page is not None:
+                yield (page_id, *page)
+
+    def retain(self, page_ids):
+        """Drop all pages not in page_ids and their files; returns the number removed."""
+        keep = set(page_ids)
+        with self._lock:
+            removed = [page_id for page_id in self._manifest() if page_id not in keep]
+            hashes = {self._manifest()[page_id].get("content_hash") for page_id in removed}
+            for page_id in removed:
+                del self._manifest()[page_id]
+            if removed:
+                self._changed()
+            for content_hash in hashes - {None}:
+                self._remove_unused_object(content_hash)
+        return len(removed)
+
+    def _remove_unused_object(self, content_hash):
+        if any(entry.get("content_hash") == content_hash for entry in self._manifest().values()):
+            return
+        path = self._object_path(content_hash)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,178 @@
+"""
+Local retrieval over the Confluence pages stored in SQLiteMemory.
+
+The normalized (Markdown) page texts are split into section-level chunks (one
+chunk per heading), ranked against the user's question with BM25 and only the
+best chunks that fit in the configured budget are injected into the prompt.
+"""
+import math
+import re
+from collections import Counter
+
+from confluence_config import get_retrieval_config
+
+_HEADING_RE = re.compile(r"^#{1,6} +(.*)$", re.MULTILINE)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# English and Dutch words that carry no meaning for ranking
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "my", "of", "on", "or", "that", "the",
+    "this", "to", "was", "what", "when", "where", "which", "who", "why", "with",
+    "you", "your", "de", "het", "een", "en", "van", "in", "op", "is", "dat", "die",
+    "voor", "met", "hoe", "wat", "ik", "mijn", "te", "er", "zijn", "om", "aan",
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords and single characters."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _split_long_text(text, max_chars):
+    """Split text on line boundaries into pieces of at most max_chars."""
+    if len(text) <= max_chars:
+        return [text]
+    pieces, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            pieces.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(page_id, title, content, max_chars=1500):
+    """
+    Split a normalized (Markdown) page into section-level chunks.
+
+    Each heading starts a new section; sections longer than max_chars are
+    split further on line boundaries. Returns a list of chunk dicts.
+    """
+    sections = []
+    last_end, heading = 0, ""
+    for match in _HEADING_RE.finditer(content):
+        sections.append((heading, content[last_end:match.start()]))
+        heading = match.group(1).strip()
+        last_end = match.end()
+    sections.append((heading, content[last_end:]))
+
+    chunks = []
+    for heading, body in sections:
+        text = body.strip()
+        if not text:
+            continue
+        for piece in _split_long_text(text, max_chars):
+            chunks.append({
+                "page_id": page_id,
+                "title": title,
+                "heading": heading,
+                "text": piece,
+            })
+    return chunks
+
+
+def format_chunk(chunk):
+    """Format a chunk as a prompt section headed by its page title and heading."""
+    header = f"### {chunk['title']}"
+    if chunk["heading"]:
+        header += f" - {chunk['heading']}"
+    return f"{header} (PAGE ID: {chunk['page_id']})\n{chunk['text']}"
+
+
+KNOWLEDGE_HEADER = "CONFLUENCE KNOWLEDGE BASE (relevant excerpts):\n"
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a fixed list of chunks."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = []
+        self.doc_lengths = []
+        doc_freqs = Counter()
+        for chunk in chunks:
+            # Title and heading are indexed with the text so they count as matches
+            tokens = tokenize(f"{chunk['title']} {chunk['heading']} {chunk['text']}")
+            freqs = Counter(tokens)
+            self.term_freqs.append(freqs)
+            self.doc_lengths.append(len(tokens))
+            doc_freqs.update(freqs.keys())
+        n_docs = len(chunks)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+    def search(self, query, top_k=5):
+        """Return (score, chunk) pairs for the best matching chunks."""
+        terms = set(tokenize(query))
+        if not terms or not self.chunks:
+            return []
+        scored = []
+        for i, freqs in enumerate(self.term_freqs):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / (self.avg_length or 1))
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        return [(score, self.chunks[i]) for score, i in scored[:top_k]]
+
+
+class KnowledgeRetriever:
+    """
+    Builds and caches a BM25 index over the stored Confluence pages and
+    assembles a prompt context from the chunks relevant to a question.
+    """
+
+    def __init__(self, memory, config=None):
+        self.memory = memory
+        self.config = config or get_retrieval_config()
+        self._index = None
+        self._fingerprint = None
+
+    def _get_index(self):
+        # Rebuild only when the set of stored pages or their content changed
+        fingerprint = self.memory.get_confluence_fingerprint()
+        if self._index is None or fingerprint != self._fingerprint:
+            chunks = []
+            for page_id, title, content in self.memory.get_all_confluence_page_contents(normalized=True):
+                chunks.extend(split_into_chunks(page_id, title, content, self.config["chunk_chars"]))
+            self._index = BM25Index(chunks, self.config["bm25_k1"], self.config["bm25_b"])
+            self._fingerprint = fingerprint
+        return self._index
+
+    def retrieve(self, question):
+        """Return the top-k chunks for the question that fit in the budget."""
+        budget = self.config["max_context_chars"]
+        selected, used = [], 0
+        for score, chunk in self._get_index().search(question, self.config["top_k"]):
+            size = len(chunk["text"])
+            if used + size > budget:
+                continue
+            selected.append(chunk)
+            used += size
+        return selected
+
+    def get_context(self, question):
+        """Format the relevant chunks as a knowledge-base section for the prompt."""
+        chunks = self.retrieve(question)
+        if not chunks:
+            return ""
+        return KNOWLEDGE_HEADER + "\n\n".join(format_chunk(chunk) for chunk in chunks)
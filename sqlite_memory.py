@@ -1,85 +1,689 @@
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import shutil
 import hashlib
+import re
+import threading
+import atexit
+import itertools
+import queue
+import time
+import gzip
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from blob_codec import compress, decompress, train_dictionary
+from content_normalizer import NORMALIZER_VERSION, normalize_storage_format
+from metrics import instrument_methods, registry
+
+# Stored in PRAGMA user_version; bump together with a step in _migrate()
+SCHEMA_VERSION = 6
+
+# Applied once to every new connection
+SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,         # Wait up to 5 s for a lock instead of failing at once (first: the next pragmas may wait)
+    "auto_vacuum": "INCREMENTAL", # Only takes effect before the first write; existing files: see compact()
+    "foreign_keys": "ON",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",      # Safe with WAL; commits no longer wait for an fsync
+    "cache_size": -16000,         # Negative means KiB, so ~16 MB page cache per connection
+    "mmap_size": 268435456,       # Read pages through a 256 MB memory map
+    "journal_size_limit": 67108864,  # Truncate the WAL file back to 64 MB after a checkpoint
+}
+
+# Several processes sharing one database file: SQLiteMemory(..., multi_process=True)
+MULTI_PROCESS = {
+    "busy_timeout": 30000,        # Milliseconds SQLite itself waits for a lock held by another process
+    "busy_retries": 8,            # Attempts of a write transaction that still ends in SQLITE_BUSY/LOCKED
+    "retry_delay": 0.05,          # First backoff in seconds, doubled per attempt (with jitter)
+    "checkpoint_interval": 30,    # Seconds between the PASSIVE checkpoints of start_checkpoints()
+    "truncate_wal_mb": 64,        # A larger WAL file gets a TRUNCATE checkpoint instead
+}
+
+# Number of compiled statements each connection keeps (sqlite3's statement LRU)
+STATEMENT_CACHE_SIZE = 256
+
+# Prefix of the knowledge base copies older versions appended to the memory table
+_LEGACY_KNOWLEDGE_PREFIX = "CONFLUENCE KNOWLEDGE BASE:"
+
+# Group commits of the optional background writer: flush at this many rows or after this many seconds
+WRITE_BATCH_SIZE = 200
+WRITE_FLUSH_INTERVAL = 0.05
+
+# Online backups: pages copied per step, pause between steps and number of backups kept
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_KEEP = 10
+
+# Page bodies are compressed; run_maintenance() trains a preset dictionary once this many
+# bodies are stored, sampling at most BLOB_DICTIONARY_SAMPLES of them
+BLOB_DICTIONARY_MIN_PAGES = 20
+BLOB_DICTIONARY_SAMPLES = 500
+
+# Retention of the memory table, applied per session by apply_retention()
+MEMORY_RETENTION = {
+    "max_age_days": 30,           # Older messages are rolled up into a summary row
+    "max_rows_per_session": 200,  # Only the newest rows of a session are kept as they are
+    "delete_batch": 500,          # Rows deleted per transaction
+    "summary_chars": 4000,        # Maximum length of a summary row
+    "summary_line_chars": 200,    # Characters kept per rolled-up message
+    "interval_seconds": 3600,     # Schedule of start_maintenance()
+}
+
+_FTS_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# First line of a row written by summarize_turns: message count and time range
+_SUMMARY_HEADER_RE = re.compile(r"Summary of (\d+) earlier messages \((.*?) - (.*?)\):")
+
+def is_busy_error(error):
+    """True for the SQLITE_BUSY / SQLITE_LOCKED errors another connection's lock causes."""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+def build_fts_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression.
+
+    Every word becomes a quoted (prefix) term and terms are OR-ed, so documents
+    matching more of the words get a better bm25 rank. Returns None when the
+    text contains no searchable words.
+    """
+    terms = []
+    for token in _FTS_TOKEN_RE.findall(text.lower()):
+        term = '"' + token.replace('"', '""') + '"'
+        # Prefix matching for longer words so "key" also finds "keys"
+        terms.append(term + "*" if len(token) >= 3 else term)
+    return " OR ".join(terms) if terms else None
+
+def summarize_turns(rows, max_chars=MEMORY_RETENTION["summary_chars"],
+                    line_chars=MEMORY_RETENTION["summary_line_chars"]):
+    """
+    Extractive summary of (timestamp, role, message) rows: one shortened line per
+    message in chronological order. The lines and count of an earlier summary row
+    are carried forward as they are. When max_chars is reached the oldest lines are
+    left out, so the turns closest to the kept history survive repeated roll-ups.
+    """
+    if not rows:
+        return ""
+    count, first, lines, truncated = 0, rows[0][0], [], False
+    for index, (timestamp, role, message) in enumerate(rows):
+        match = _SUMMARY_HEADER_RE.match(message or "") if role == "summary" else None
+        if match:
+            count += int(match.group(1))
+            if index == 0:
+                first = match.group(2)
+            carried = message.split("\n")[1:]
+            truncated = truncated or "- ..." in carried
+            lines.extend(line for line in carried if line != "- ...")
+            continue
+        count += 1
+        text = " ".join((message or "").split())
+        if len(text) > line_chars:
+            text = text[:line_chars].rstrip() + "..."
+        lines.append(f"- {role}: {text}")
+    header = f"Summary of {count} earlier messages ({first} - {rows[-1][0]}):"
+    kept, used = [], len(header) + len("\n- ...")
+    for line in reversed(lines):
+        if used + len(line) + 1 > max_chars:
+            truncated = True
+            break
+        kept.append(line)
+        used += len(line) + 1
+    if truncated:
+        kept.append("- ...")
+    return "\n".join([header] + kept[::-1])
+
+
+class GroupCommitWriter:
+    """
+    Background thread that queues inserts and writes them in group commits.
+
+    Queued statements are collected until batch_size rows are waiting or
+    flush_interval seconds have passed, then written in order with executemany
+    in a single transaction. flush() blocks until everything queued before it
+    is committed; close() flushes and stops the thread (also at exit).
+    """
+
+    _STOP = object()
+
+    def __init__(self, memory, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sqlite-group-commit", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, sql, params):
+        if self._closed:
+            raise RuntimeError("GroupCommitWriter is closed")
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        """Wait until every statement submitted before this call is committed."""
+        if self._closed or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch, waiters, stop = [], [], False
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                # A flush request or shutdown writes immediately
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for done in waiters:
+                done.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        def write_batch(conn):
+            # Consecutive rows for the same statement go through one executemany
+            for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+                conn.executemany(sql, [params for _, params in group])
+
+        try:
+            self.memory.write_transaction(write_batch)
+        except sqlite3.Error as e:
+            print(f"❌ Group commit of {len(batch)} rows failed ({e}), writing rows one by one")
+            for sql, params in batch:
+                try:
+                    self.memory.write_transaction(lambda conn: conn.execute(sql, params))
+                except sqlite3.Error as row_error:
+                    print(f"❌ Dropped write: {row_error}")
+
 
 class SQLiteMemory:
-    def __init__(self, db_path="agent_memory.db"):
+    def __init__(self, db_path="agent_memory.db", pragmas=None, buffered_writes=False,
+                 batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, multi_process=False):
         self.db_path = db_path
+        # multi_process: longer busy timeout and every implicit transaction starts as BEGIN IMMEDIATE
+        self.multi_process = multi_process
+        base_pragmas = {**SQLITE_PRAGMAS, "busy_timeout": MULTI_PROCESS["busy_timeout"]} if multi_process else SQLITE_PRAGMAS
+        self.pragmas = {**base_pragmas, **(pragmas or {})}
+        # One persistent connection per thread, opened on first use
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._pid = os.getpid()
+        # Knowledge base snapshot kept in process, keyed by its version
+        self._snapshot_cache = None
+        self._snapshot_lock = threading.Lock()
+        # Compression dictionaries of confluence_blobs by id
+        self._dictionaries = {}
         self.create_table()
+        # Optional background writer for group commits of inserts (see write())
+        self._writer = GroupCommitWriter(self, batch_size, flush_interval) if buffered_writes else None
+        self._backup_executor = None
+        self._maintenance_stop = None
+        self._checkpoint_stop = None
         # Create backup directory
         self.backup_dir = os.path.join(os.path.dirname(self.db_path), "backups")
         os.makedirs(self.backup_dir, exist_ok=True)
 
+    def connection(self):
+        """
+        Return this thread's persistent connection, creating it on first use.
+
+        Use it as a context manager (``with memory.connection() as conn:``) to
+        commit on success and roll back on errors; the connection stays open.
+        """
+        if os.getpid() != self._pid:
+            # Connections must not be shared with a forked child process
+            self._local = threading.local()
+            self._connections = []
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+                # A deferred transaction that later writes fails at once when another process wrote in between
+                isolation_level="IMMEDIATE" if self.multi_process else ""
+            )
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            # inflate(dictionary_id, data) decompresses a confluence_blobs row inside queries
+            conn.create_function("inflate", 2, self._inflate, deterministic=True)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def write(self, sql, params=()):
+        """
+        Run an insert-like statement: queued for the next group commit when
+        buffered writes are enabled, committed right away otherwise.
+        """
+        if self._writer is not None:
+            self._writer.submit(sql, params)
+        else:
+            self.write_transaction(lambda conn: conn.execute(sql, params))
+
+    def write_transaction(self, fn, *args):
+        """
+        Run fn(conn, *args) in a BEGIN IMMEDIATE transaction and commit it; returns fn's result.
+
+        Taking the write lock up front means the transaction either waits for other
+        writers (busy_timeout) or fails before doing any work, so it can be retried:
+        SQLITE_BUSY/LOCKED errors are retried with exponential backoff. Called inside
+        an open transaction, fn simply joins it.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            return fn(conn, *args)
+        for attempt in itertools.count(1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = fn(conn, *args)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                return result
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt >= MULTI_PROCESS["busy_retries"]:
+                    raise
+                registry.increment("sqlite_busy_retries")
+                time.sleep(MULTI_PROCESS["retry_delay"] * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def flush(self):
+        """Commit all queued writes now, for callers that need to read their own writes."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Close the connections of all threads; they are reopened on next use."""
+        self.flush()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+        # A restored database may reuse snapshot versions and dictionary ids for other content
+        with self._snapshot_lock:
+            self._snapshot_cache = None
+        self._dictionaries = {}
+
     def create_table(self):
-        with sqlite3.connect(self.db_path) as conn:
-            # Enable foreign keys and WAL mode for better data integrity
-            conn.execute("PRAGMA foreign_keys = ON")
-            conn.execute("PRAGMA journal_mode = WAL")
-            
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS memory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT,
-                    role TEXT,
-                    message TEXT
+        # One write transaction, so processes starting together do not migrate twice
+        self.write_transaction(self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                role TEXT,
+                message TEXT
+            )
+        """)
+        # Create a table for user facts
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS facts (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        # Create a table for Confluence pages with better indexing
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS confluence_pages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                page_id TEXT UNIQUE,
+                title TEXT,
+                content TEXT,
+                content_hash TEXT,
+                timestamp TEXT,
+                last_accessed TEXT
+            )
+        """)
+        # Create indexes for better search performance
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_page_id ON confluence_pages(page_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_title ON confluence_pages(title)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_timestamp ON confluence_pages(timestamp)")
+        # Compact Markdown version of each page body, converted once per content hash
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS confluence_normalized (
+                content_hash TEXT PRIMARY KEY,
+                normalized TEXT,
+                normalizer_version INTEGER,
+                timestamp TEXT
+            )
+        """)
+        # Compressed page bodies, stored once per content hash (confluence_pages.content is no longer used)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS confluence_blobs (
+                content_hash TEXT PRIMARY KEY,
+                dictionary_id INTEGER,
+                data BLOB,
+                chars INTEGER
+            )
+        """)
+        # Preset dictionaries for the blobs; a dictionary is never changed once stored
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS compression_dictionaries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data BLOB,
+                timestamp TEXT
+            )
+        """)
+        # State of the knowledge base (the page-store manifest), stored once per distinct content
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS knowledge_snapshots (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT UNIQUE,
+                content TEXT,
+                timestamp TEXT
+            )
+        """)
+        self._migrate(conn)
+        self._create_confluence_fts(conn)
+        self._normalize_stale_pages(conn)
+
+    def _migrate(self, conn):
+        """Upgrade databases created by older versions of this class."""
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # The full-text index used to cover raw storage format; it now covers normalized text
+            for trigger in ("confluence_pages_fts_insert", "confluence_pages_fts_update", "confluence_pages_fts_delete"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute("DROP TABLE IF EXISTS confluence_pages_fts")
+        if version < 2:
+            # Confluence version number of the stored body, used for incremental syncs
+            conn.execute("ALTER TABLE confluence_pages ADD COLUMN version INTEGER")
+        if version < 3:
+            # Move the newest knowledge base copy out of memory and drop all copies from it
+            legacy = conn.execute(
+                "SELECT message FROM memory WHERE role = 'system' AND message LIKE ? ORDER BY id DESC LIMIT 1",
+                (_LEGACY_KNOWLEDGE_PREFIX + "%",)
+            ).fetchone()
+            if legacy:
+                content = legacy[0][len(_LEGACY_KNOWLEDGE_PREFIX):].lstrip("\n")
+                self._insert_knowledge_snapshot(conn, content)
+                conn.execute(
+                    "DELETE FROM memory WHERE role = 'system' AND message LIKE ?",
+                    (_LEGACY_KNOWLEDGE_PREFIX + "%",)
                 )
-            """)
-            # Create a table for user facts
+        if version < 4:
+            # Conversation of each chat session; NULL is the default (CLI) session
+            conn.execute("ALTER TABLE memory ADD COLUMN session_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_session ON memory(session_id, id)")
+        if version < 5:
+            # When the page was last confirmed against Confluence; drives the freshness TTL of the page cache
+            conn.execute("ALTER TABLE confluence_pages ADD COLUMN fetched_at TEXT")
+            conn.execute("UPDATE confluence_pages SET fetched_at = timestamp")
+        if version < 6:
+            # Page bodies move to confluence_blobs, compressed and stored once per content hash
+            for content_hash, content in conn.execute(
+                "SELECT content_hash, content FROM confluence_pages WHERE content IS NOT NULL"
+            ):
+                self._store_blob(conn, content_hash, content)
+            conn.execute("UPDATE confluence_pages SET content = NULL")
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _create_confluence_fts(self, conn):
+        """Full-text index over the normalized text of confluence_pages, kept in sync by triggers."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'confluence_pages_fts'"
+        ).fetchone()
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS confluence_pages_fts USING fts5(
+                title, content, tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS confluence_pages_fts_insert AFTER INSERT ON confluence_pages BEGIN
+                INSERT INTO confluence_pages_fts (rowid, title, content) VALUES (
+                    new.id, new.title,
+                    (SELECT normalized FROM confluence_normalized WHERE content_hash = new.content_hash)
+                );
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS confluence_pages_fts_update AFTER UPDATE OF title, content_hash ON confluence_pages BEGIN
+                DELETE FROM confluence_pages_fts WHERE rowid = old.id;
+                INSERT INTO confluence_pages_fts (rowid, title, content) VALUES (
+                    new.id, new.title,
+                    (SELECT normalized FROM confluence_normalized WHERE content_hash = new.content_hash)
+                );
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS confluence_pages_fts_delete AFTER DELETE ON confluence_pages BEGIN
+                DELETE FROM confluence_pages_fts WHERE rowid = old.id;
+            END
+        """)
+        if not exists:
+            # Index pages stored before the full-text index existed
             conn.execute("""
-                CREATE TABLE IF NOT EXISTS facts (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
+                INSERT INTO confluence_pages_fts (rowid, title, content)
+                SELECT p.id, p.title, n.normalized
+                FROM confluence_pages p LEFT JOIN confluence_normalized n ON n.content_hash = p.content_hash
             """)
-            # Create a table for Confluence pages with better indexing
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS confluence_pages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    page_id TEXT UNIQUE,
-                    title TEXT,
-                    content TEXT,
-                    content_hash TEXT,
-                    timestamp TEXT,
-                    last_accessed TEXT
+
+    def _store_normalized(self, conn, content_hash, content):
+        """Convert a page body to Markdown unless this content hash was already converted."""
+        existing = conn.execute(
+            "SELECT normalizer_version FROM confluence_normalized WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        if existing and existing[0] >= NORMALIZER_VERSION:
+            return False
+        conn.execute(
+            "REPLACE INTO confluence_normalized (content_hash, normalized, normalizer_version, timestamp) VALUES (?, ?, ?, ?)",
+            (content_hash, normalize_storage_format(content), NORMALIZER_VERSION, datetime.now().isoformat())
+        )
+        return True
+
+    def _normalize_stale_pages(self, conn):
+        """Normalize pages that have no (up-to-date) conversion yet and refresh their index entries."""
+        stale = conn.execute("""
+            SELECT p.content_hash, inflate(b.dictionary_id, b.data)
+            FROM confluence_pages p
+            LEFT JOIN confluence_normalized n ON n.content_hash = p.content_hash
+            LEFT JOIN confluence_blobs b ON b.content_hash = p.content_hash
+            WHERE n.content_hash IS NULL OR n.normalizer_version < ?
+        """, (NORMALIZER_VERSION,)).fetchall()
+        for content_hash, content in stale:
+            if self._store_normalized(conn, content_hash, content or ""):
+                conn.execute(
+                    "DELETE FROM confluence_pages_fts WHERE rowid IN (SELECT id FROM confluence_pages WHERE content_hash = ?)",
+                    (content_hash,)
                 )
-            """)
-            # Create indexes for better search performance
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_page_id ON confluence_pages(page_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_title ON confluence_pages(title)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_confluence_timestamp ON confluence_pages(timestamp)")
+                conn.execute("""
+                    INSERT INTO confluence_pages_fts (rowid, title, content)
+                    SELECT p.id, p.title, n.normalized
+                    FROM confluence_pages p JOIN confluence_normalized n ON n.content_hash = p.content_hash
+                    WHERE p.content_hash = ?
+                """, (content_hash,))
 
-    def add_message(self, role, message):
-        with sqlite3.connect(self.db_path) as conn:
+    def _drop_unused_normalized(self, conn, content_hash):
+        """Remove the conversion and the body of a content hash that no page refers to anymore."""
+        for table in ("confluence_normalized", "confluence_blobs"):
             conn.execute(
-                "INSERT INTO memory (timestamp, role, message) VALUES (?, ?, ?)",
-                (datetime.now().isoformat(), role, message)
+                f"DELETE FROM {table} WHERE content_hash = ? AND NOT EXISTS "
+                "(SELECT 1 FROM confluence_pages WHERE content_hash = ?)",
+                (content_hash, content_hash)
             )
 
-    def get_history(self, limit=10):
-        with sqlite3.connect(self.db_path) as conn:
+    def _dictionary(self, dictionary_id):
+        """Bytes of a compression dictionary, cached per id (None for no dictionary)."""
+        if dictionary_id is None:
+            return None
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            # Separate connection: this also runs inside inflate() during a query
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute(
+                    "SELECT data FROM compression_dictionaries WHERE id = ?", (dictionary_id,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                raise sqlite3.DatabaseError(f"Compression dictionary {dictionary_id} is missing")
+            dictionary = self._dictionaries[dictionary_id] = bytes(row[0])
+        return dictionary
+
+    def _inflate(self, dictionary_id, data):
+        if data is None:
+            return None
+        return decompress(data, self._dictionary(dictionary_id))
+
+    def _store_blob(self, conn, content_hash, content):
+        """Compress a page body with the newest dictionary unless this content hash is stored."""
+        if conn.execute("SELECT 1 FROM confluence_blobs WHERE content_hash = ?", (content_hash,)).fetchone():
+            return False
+        row = conn.execute(
+            "SELECT id, data FROM compression_dictionaries ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        dictionary_id = row[0] if row else None
+        if row:
+            self._dictionaries.setdefault(dictionary_id, bytes(row[1]))
+        conn.execute(
+            "INSERT INTO confluence_blobs (content_hash, dictionary_id, data, chars) VALUES (?, ?, ?, ?)",
+            (content_hash, dictionary_id, compress(content, self._dictionary(dictionary_id)), len(content))
+        )
+        return True
+
+    def _insert_knowledge_snapshot(self, conn, content):
+        """Store content as the newest snapshot unless it equals it; return (version, created)."""
+        content_hash = hashlib.md5(content.encode('utf-8')).hexdigest()
+        latest = conn.execute(
+            "SELECT version, content_hash FROM knowledge_snapshots ORDER BY version DESC LIMIT 1"
+        ).fetchone()
+        if latest and latest[1] == content_hash:
+            return latest[0], False
+        # A snapshot that reappears gets a new version so the newest one always wins
+        conn.execute("DELETE FROM knowledge_snapshots WHERE content_hash = ?", (content_hash,))
+        cursor = conn.execute(
+            "INSERT INTO knowledge_snapshots (content_hash, content, timestamp) VALUES (?, ?, ?)",
+            (content_hash, content, datetime.now().isoformat())
+        )
+        # Only the newest snapshot is needed; older ones would grow the database on every change
+        conn.execute("DELETE FROM knowledge_snapshots WHERE version < ?", (cursor.lastrowid,))
+        return cursor.lastrowid, True
+
+    def save_knowledge_snapshot(self, content):
+        """
+        Store the knowledge base state once (app.py stores the page-store manifest the
+        database was loaded from). Saving the same content again is a no-op, so restarts
+        do not grow the database. Returns the snapshot version.
+        """
+        with self.connection() as conn:
+            version, created = self._insert_knowledge_snapshot(conn, content)
+        if created:
+            with self._snapshot_lock:
+                self._snapshot_cache = (version, content)
+        return version
+
+    def get_knowledge_snapshot_version(self):
+        """Version of the newest knowledge snapshot (a primary key lookup), or None."""
+        with self.connection() as conn:
+            result = conn.execute("SELECT MAX(version) FROM knowledge_snapshots").fetchone()
+            return result[0] if result else None
+
+    def get_knowledge_snapshot(self):
+        """
+        Return (version, content) of the newest knowledge snapshot, or (None, "") when none
+        is stored. The content is cached in process and only read again when the version changes.
+        """
+        version = self.get_knowledge_snapshot_version()
+        if version is None:
+            return None, ""
+        with self._snapshot_lock:
+            cached = self._snapshot_cache
+        if cached and cached[0] == version:
+            return cached
+        with self.connection() as conn:
+            result = conn.execute(
+                "SELECT content FROM knowledge_snapshots WHERE version = ?", (version,)
+            ).fetchone()
+        if result is None:
+            return None, ""
+        with self._snapshot_lock:
+            self._snapshot_cache = (version, result[0])
+        return version, result[0]
+
+    def add_message(self, role, message, session_id=None):
+        """Store a message in the conversation of session_id (None is the default session)."""
+        self.write(
+            "INSERT INTO memory (timestamp, role, message, session_id) VALUES (?, ?, ?, ?)",
+            (datetime.now().isoformat(), role, message, session_id)
+        )
+
+    def get_history(self, limit=10, session_id=None):
+        """Last limit messages of one session; an index range scan on (session_id, id)."""
+        self.flush()
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT role, message FROM memory ORDER BY id DESC LIMIT ?",
-                (limit,)
+                "SELECT role, message FROM memory WHERE session_id IS ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
             )
             return cursor.fetchall()[::-1]  # Return in chronological order
 
+    def has_history(self, session_id=None):
+        """True when the session has any message other than a summary row."""
+        self.flush()
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT 1 FROM memory WHERE session_id IS ? AND role != 'summary' LIMIT 1", (session_id,)
+            ).fetchone() is not None
+
+    def clear_session(self, session_id):
+        """Delete the conversation of one session."""
+        self.flush()
+        self.write_transaction(lambda conn: conn.execute("DELETE FROM memory WHERE session_id IS ?", (session_id,)))
+
     def clear(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("DELETE FROM memory") 
+        self.flush()
+        def clear_all(conn):
+            conn.execute("DELETE FROM memory")
             conn.execute("DELETE FROM facts")
 
+        self.write_transaction(clear_all)
+
     def set_fact(self, key, value):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "REPLACE INTO facts (key, value) VALUES (?, ?)",
-                (key, value)
-            )
+        self.write_transaction(lambda conn: conn.execute(
+            "REPLACE INTO facts (key, value) VALUES (?, ?)",
+            (key, value)
+        ))
 
     def get_fact(self, key):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT value FROM facts WHERE key = ?",
@@ -89,59 +693,122 @@ class SQLiteMemory:
             return result[0] if result else None
 
     def get_all_facts(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT key, value FROM facts")
             return dict(cursor.fetchall())
 
-    def add_confluence_page(self, page_id, title, content):
-        """Add a Confluence page with duplicate prevention and content hashing."""
+    def add_confluence_page(self, page_id, title, content, version=None, fetched=True):
+        """Add a Confluence page with duplicate prevention and content hashing.
+
+        version is the Confluence version number of the body, if known. fetched says
+        whether the content comes straight from Confluence; only then the page counts
+        as fresh for get_cached_confluence_page.
+        """
+        return self.write_transaction(self._add_confluence_page, page_id, title, content, version, fetched)
+
+    def add_confluence_pages(self, pages, fetched=True):
+        """
+        add_confluence_page for an iterable of (page_id, title, content, version) in one
+        transaction; returns the number of new or changed pages.
+        """
+        # Materialized first: a retried transaction must see the same pages again
+        pages = list(pages)
+
+        def add_all(conn):
+            changed = 0
+            for page_id, title, content, version in pages:
+                message = self._add_confluence_page(conn, page_id, title, content, version, fetched)
+                changed += not message.endswith("Updated access time.")
+            return changed
+
+        return self.write_transaction(add_all)
+
+    def _add_confluence_page(self, conn, page_id, title, content, version, fetched):
         content_hash = hashlib.md5(content.encode('utf-8')).hexdigest()
         current_time = datetime.now().isoformat()
+        fetched_at = current_time if fetched else None
         
-        with sqlite3.connect(self.db_path) as conn:
-            # Check if page already exists
-            cursor = conn.cursor()
-            cursor.execute("SELECT content_hash FROM confluence_pages WHERE page_id = ?", (page_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                if existing[0] == content_hash:
-                    # Content hasn't changed, just update last_accessed
-                    conn.execute(
-                        "UPDATE confluence_pages SET last_accessed = ? WHERE page_id = ?",
-                        (current_time, page_id)
-                    )
-                    return f"Page '{title}' already exists with same content. Updated access time."
-                else:
-                    # Content has changed, update it
-                    conn.execute(
-                        "UPDATE confluence_pages SET title = ?, content = ?, content_hash = ?, timestamp = ?, last_accessed = ? WHERE page_id = ?",
-                        (title, content, content_hash, current_time, current_time, page_id)
-                    )
-                    return f"Page '{title}' updated with new content."
+        # Check if page already exists
+        cursor = conn.cursor()
+        cursor.execute("SELECT content_hash FROM confluence_pages WHERE page_id = ?", (page_id,))
+        existing = cursor.fetchone()
+        
+        if existing:
+            if existing[0] == content_hash:
+                # Content hasn't changed, just update last_accessed (and the version it was seen at)
+                conn.execute(
+                    "UPDATE confluence_pages SET last_accessed = ?, version = COALESCE(?, version), "
+                    "fetched_at = COALESCE(?, fetched_at) WHERE page_id = ?",
+                    (current_time, version, fetched_at, page_id)
+                )
+                return f"Page '{title}' already exists with same content. Updated access time."
             else:
-                # New page
+                # Content has changed, update it (normalized first, the index trigger reads it)
+                self._store_normalized(conn, content_hash, content)
+                self._store_blob(conn, content_hash, content)
                 conn.execute(
-                    "INSERT INTO confluence_pages (page_id, title, content, content_hash, timestamp, last_accessed) VALUES (?, ?, ?, ?, ?, ?)",
-                    (page_id, title, content, content_hash, current_time, current_time)
+                    "UPDATE confluence_pages SET title = ?, content_hash = ?, version = ?, timestamp = ?, last_accessed = ?, fetched_at = ? WHERE page_id = ?",
+                    (title, content_hash, version, current_time, current_time, fetched_at, page_id)
                 )
-                return f"New page '{title}' added successfully."
+                self._drop_unused_normalized(conn, existing[0])
+                return f"Page '{title}' updated with new content."
+        else:
+            # New page
+            self._store_normalized(conn, content_hash, content)
+            self._store_blob(conn, content_hash, content)
+            conn.execute(
+                "INSERT INTO confluence_pages (page_id, title, content_hash, version, timestamp, last_accessed, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (page_id, title, content_hash, version, current_time, current_time, fetched_at)
+            )
+            return f"New page '{title}' added successfully."
 
     def search_confluence_pages(self, query, limit=5):
-        with sqlite3.connect(self.db_path) as conn:
+        """Full-text search over stored pages, best bm25 match first (title weighs more)."""
+        fts_query = build_fts_query(query)
+        if fts_query is None:
+            return []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT p.page_id, p.title, inflate(b.dictionary_id, b.data)
+                FROM confluence_pages_fts f JOIN confluence_pages p ON p.id = f.rowid
+                LEFT JOIN confluence_blobs b ON b.content_hash = p.content_hash
+                WHERE confluence_pages_fts MATCH ?
+                ORDER BY bm25(confluence_pages_fts, 5.0, 1.0) LIMIT ?
+                """,
+                (fts_query, limit)
+            )
+            return cursor.fetchall()
+
+    def search_confluence_snippets(self, query, limit=5, snippet_tokens=32):
+        """Like search_confluence_pages, but returns (page_id, title, snippet) with matches in [brackets]."""
+        fts_query = build_fts_query(query)
+        if fts_query is None:
+            return []
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT page_id, title, content FROM confluence_pages WHERE title LIKE ? OR content LIKE ? ORDER BY last_accessed DESC LIMIT ?",
-                (f"%{query}%", f"%{query}%", limit)
+                """
+                SELECT p.page_id, p.title, snippet(confluence_pages_fts, 1, '[', ']', ' ... ', ?)
+                FROM confluence_pages_fts f JOIN confluence_pages p ON p.id = f.rowid
+                WHERE confluence_pages_fts MATCH ?
+                ORDER BY bm25(confluence_pages_fts, 5.0, 1.0) LIMIT ?
+                """,
+                (snippet_tokens, fts_query, limit)
             )
             return cursor.fetchall()
 
     def get_confluence_page_by_id(self, page_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT page_id, title, content FROM confluence_pages WHERE page_id = ?",
+                """
+                SELECT p.page_id, p.title, inflate(b.dictionary_id, b.data) FROM confluence_pages p
+                LEFT JOIN confluence_blobs b ON b.content_hash = p.content_hash
+                WHERE p.page_id = ?
+                """,
                 (page_id,)
             )
             result = cursor.fetchone()
@@ -153,80 +820,462 @@ class SQLiteMemory:
                 )
             return result
 
+    def get_cached_confluence_page(self, page_id):
+        """
+        Stored copy of a page for the read-through cache: a dict with title, the
+        normalized content and age_seconds since it was last fetched from Confluence
+        (None when it never was), or None when the page is not stored.
+        """
+        with self.connection() as conn:
+            result = conn.execute(
+                """
+                SELECT p.title, n.normalized, p.fetched_at FROM confluence_pages p
+                JOIN confluence_normalized n ON n.content_hash = p.content_hash
+                WHERE p.page_id = ?
+                """,
+                (page_id,)
+            ).fetchone()
+            if result is None:
+                return None
+            conn.execute(
+                "UPDATE confluence_pages SET last_accessed = ? WHERE page_id = ?",
+                (datetime.now().isoformat(), page_id)
+            )
+        title, content, fetched_at = result
+        age = (datetime.now() - datetime.fromisoformat(fetched_at)).total_seconds() if fetched_at else None
+        return {"title": title, "content": content, "age_seconds": age}
+
     def get_all_confluence_pages(self):
         """Get all stored Confluence pages with metadata."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT page_id, title, timestamp, last_accessed FROM confluence_pages ORDER BY last_accessed DESC"
             )
             return cursor.fetchall()
 
-    def backup_database(self, backup_name=None):
-        """Create a backup of the database."""
+    def get_normalized_content(self, page_id):
+        """Get the compact Markdown version of a stored page, or None if the page is unknown."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT n.normalized FROM confluence_pages p
+                JOIN confluence_normalized n ON n.content_hash = p.content_hash
+                WHERE p.page_id = ?
+                """,
+                (page_id,)
+            )
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def get_all_confluence_page_contents(self, normalized=False):
+        """Get page_id, title and content (raw or normalized) of all stored Confluence pages."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if normalized:
+                cursor.execute("""
+                    SELECT p.page_id, p.title, n.normalized
+                    FROM confluence_pages p JOIN confluence_normalized n ON n.content_hash = p.content_hash
+                    ORDER BY p.page_id
+                """)
+            else:
+                cursor.execute("""
+                    SELECT p.page_id, p.title, inflate(b.dictionary_id, b.data)
+                    FROM confluence_pages p LEFT JOIN confluence_blobs b ON b.content_hash = p.content_hash
+                    ORDER BY p.page_id
+                """)
+            return cursor.fetchall()
+
+    def get_confluence_page_versions(self, page_ids=None):
+        """Map page_id to the stored Confluence version number (None when unknown), optionally for page_ids only."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if page_ids is None:
+                cursor.execute("SELECT page_id, version FROM confluence_pages")
+            else:
+                page_ids = list(page_ids)
+                placeholders = ", ".join("?" * len(page_ids))
+                cursor.execute(f"SELECT page_id, version FROM confluence_pages WHERE page_id IN ({placeholders})", page_ids)
+            return dict(cursor.fetchall())
+
+    def get_confluence_fingerprint(self):
+        """Hash over all page ids and content hashes; changes whenever any page changes."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT page_id, content_hash FROM confluence_pages ORDER BY page_id")
+            digest = hashlib.md5()
+            for page_id, content_hash in cursor:
+                digest.update(f"{page_id}:{content_hash};".encode('utf-8'))
+            return digest.hexdigest()
+
+    def _copy_database(self, source_path, target_path):
+        """
+        Copy a database with the SQLite backup API in steps of BACKUP_PAGES_PER_STEP
+        pages, sleeping BACKUP_STEP_SLEEP seconds between steps so writers can go on.
+        The copy is a snapshot of the source as of the start of the backup.
+        """
+        def pause(status, remaining, total):
+            time.sleep(BACKUP_STEP_SLEEP)
+
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.execute(f"PRAGMA busy_timeout = {self.pragmas['busy_timeout']}")
+            target.execute(f"PRAGMA busy_timeout = {self.pragmas['busy_timeout']}")
+            # Without an open read transaction every write to the source restarts the
+            # backup, so under steady traffic it would never finish (WAL: writers go on)
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=pause)
+        finally:
+            if source.in_transaction:
+                source.commit()
+            target.close()
+            source.close()
+
+    def _run_backup(self, backup_path, compress):
+        self.flush()
+        target = backup_path.removesuffix(".gz") + ".tmp" if compress else backup_path + ".tmp"
+        try:
+            self._copy_database(self.db_path, target)
+            if compress:
+                with open(target, "rb") as src, gzip.open(backup_path + ".tmp.gz", "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.remove(target)
+                target = backup_path + ".tmp.gz"
+            # Only complete backups get their final name
+            os.replace(target, backup_path)
+        finally:
+            for leftover in (target, backup_path + ".tmp.gz"):
+                if os.path.exists(leftover) and leftover != backup_path:
+                    os.remove(leftover)
+        self.prune_backups()
+        return f"Database backed up to: {backup_path}"
+
+    def backup_database(self, backup_name=None, compress=False, background=False):
+        """
+        Create a consistent backup of the live database with the SQLite backup API.
+
+        compress writes a gzip file (.db.gz). With background=True the backup runs
+        in a backup thread and a Future with the result message is returned; chat
+        requests keep running in the meantime. Old backups are pruned afterwards
+        (see prune_backups).
+        """
         if backup_name is None:
             backup_name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        
+        if compress and not backup_name.endswith(".gz"):
+            backup_name += ".gz"
         backup_path = os.path.join(self.backup_dir, backup_name)
-        
-        # Create backup
-        shutil.copy2(self.db_path, backup_path)
-        
-        # Also backup WAL and SHM files if they exist
-        wal_path = self.db_path + "-wal"
-        shm_path = self.db_path + "-shm"
-        
-        if os.path.exists(wal_path):
-            shutil.copy2(wal_path, backup_path + "-wal")
-        if os.path.exists(shm_path):
-            shutil.copy2(shm_path, backup_path + "-shm")
-            
-        return f"Database backed up to: {backup_path}"
+        if not background:
+            return self._run_backup(backup_path, compress)
+        with self._connections_lock:
+            if self._backup_executor is None:
+                # One worker, so backups never run concurrently
+                self._backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-backup")
+        return self._backup_executor.submit(self._run_backup, backup_path, compress)
+
+    def prune_backups(self, keep=None):
+        """Delete all but the newest keep (default BACKUP_KEEP) automatic backup_* files."""
+        keep = BACKUP_KEEP if keep is None else keep
+        backups = sorted(
+            (entry for entry in os.scandir(self.backup_dir)
+             if entry.is_file() and entry.name.startswith("backup_")
+             and entry.name.endswith((".db", ".db.gz"))),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        removed = []
+        for entry in backups[keep:]:
+            os.remove(entry.path)
+            # Backups made by older versions came with copies of the WAL and SHM files
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(entry.path + suffix):
+                    os.remove(entry.path + suffix)
+            removed.append(entry.name)
+        return removed
 
     def restore_database(self, backup_path):
-        """Restore database from backup."""
+        """
+        Restore the database from a backup (.db or .db.gz) with the SQLite backup API.
+        The live database is overwritten page by page under SQLite's own locking, so
+        open connections see the restored content instead of a replaced file.
+        """
         if not os.path.exists(backup_path):
             raise FileNotFoundError(f"Backup file not found: {backup_path}")
         
-        # Close any existing connections
-        import gc
-        gc.collect()
-        
-        # Restore main database
-        shutil.copy2(backup_path, self.db_path)
-        
-        # Restore WAL and SHM files if they exist
-        wal_backup = backup_path + "-wal"
-        shm_backup = backup_path + "-shm"
+        self.flush()
+        source = backup_path
+        if backup_path.endswith(".gz"):
+            source = os.path.join(self.backup_dir, f".restore_{os.getpid()}.db")
+            with gzip.open(backup_path, "rb") as src, open(source, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        try:
+            self._copy_database(source, self.db_path)
+        finally:
+            if source != backup_path:
+                os.remove(source)
         
-        if os.path.exists(wal_backup):
-            shutil.copy2(wal_backup, self.db_path + "-wal")
-        if os.path.exists(shm_backup):
-            shutil.copy2(shm_backup, self.db_path + "-shm")
+        # Reopen connections and drop caches of the old content
+        self.close()
             
         return f"Database restored from: {backup_path}"
 
+    def apply_retention(self, retention=None, summarize=summarize_turns):
+        """
+        Roll messages older than max_age_days or beyond the newest
+        max_rows_per_session of each session up into one summary row, deleting the
+        originals in batches. The summary takes the id of the newest rolled-up
+        message, so it stays in place in the history, and is written before the
+        originals are deleted; an earlier summary is carried forward into it.
+        Returns the number of messages rolled up.
+        """
+        retention = {**MEMORY_RETENTION, **(retention or {})}
+        cutoff_time = (datetime.now() - timedelta(days=retention["max_age_days"])).isoformat()
+        self.flush()
+        conn = self.connection()
+        sessions = [row[0] for row in conn.execute("SELECT DISTINCT session_id FROM memory")]
+        rolled = 0
+        for session_id in sessions:
+            # Newest id that has to go: beyond the row limit or older than the age limit
+            by_count = conn.execute(
+                "SELECT id FROM memory WHERE session_id IS ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (session_id, retention["max_rows_per_session"])
+            ).fetchone()
+            by_age = conn.execute(
+                "SELECT MAX(id) FROM memory WHERE session_id IS ? AND timestamp < ?",
+                (session_id, cutoff_time)
+            ).fetchone()
+            cutoff_id = max(by_count[0] if by_count else 0, by_age[0] or 0)
+            if not cutoff_id:
+                continue
+            rows = conn.execute(
+                "SELECT id, timestamp, role, message FROM memory WHERE session_id IS ? AND id <= ? ORDER BY id",
+                (session_id, cutoff_id)
+            ).fetchall()
+            # Rows older than the newest summary are already in it (left by an interrupted roll-up)
+            last_summary = max((row_id for row_id, _, role, _ in rows if role == "summary"), default=0)
+            rows = [row for row in rows if row[0] >= last_summary]
+            new_rows = sum(1 for _, _, role, _ in rows if role != "summary")
+            if new_rows:
+                summary = summarize([(timestamp, role, message) for _, timestamp, role, message in rows])
+                # The summary replaces the newest rolled-up message before any original is deleted
+                with conn:
+                    conn.execute("DELETE FROM memory WHERE id = ?", (cutoff_id,))
+                    conn.execute(
+                        "INSERT INTO memory (id, timestamp, role, message, session_id) VALUES (?, ?, 'summary', ?, ?)",
+                        (cutoff_id, rows[-1][1], summary, session_id)
+                    )
+                rolled += new_rows
+            else:
+                cutoff_id = last_summary
+            while True:
+                with conn:
+                    deleted = conn.execute(
+                        "DELETE FROM memory WHERE id IN (SELECT id FROM memory WHERE session_id IS ? AND id < ? "
+                        "ORDER BY id LIMIT ?)",
+                        (session_id, cutoff_id, retention["delete_batch"])
+                    ).rowcount
+                if not deleted:
+                    break
+        return rolled
+
+    def compact(self):
+        """Return free pages to the file system and truncate the WAL file."""
+        self.flush()
+        conn = self.connection()
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # One full VACUUM switches an existing database to incremental vacuum
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        # executescript steps the pragma to completion; execute() would free a single page
+        conn.executescript("PRAGMA incremental_vacuum;")
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        freed = pages_before - conn.execute("PRAGMA page_count").fetchone()[0]
+        return {"freed_pages": freed, "checkpoint_busy": bool(busy), "checkpointed_pages": checkpointed}
+
+    def train_compression_dictionary(self, samples=BLOB_DICTIONARY_SAMPLES):
+        """
+        Build a preset dictionary from up to samples stored page bodies and recompress
+        every body that gets smaller with it. Returns a summary dict, or None when
+        the bodies have no repeated markup to learn from.
+        """
+        with self.connection() as conn:
+            bodies = [row[0] for row in conn.execute(
+                "SELECT inflate(dictionary_id, data) FROM confluence_blobs ORDER BY random() LIMIT ?", (samples,)
+            )]
+            dictionary = train_dictionary(bodies)
+            if not dictionary:
+                return None
+            dictionary_id = conn.execute(
+                "INSERT INTO compression_dictionaries (data, timestamp) VALUES (?, ?)",
+                (dictionary, datetime.now().isoformat())
+            ).lastrowid
+            self._dictionaries[dictionary_id] = dictionary
+            before = after = recompressed = 0
+            rows = conn.execute(
+                "SELECT content_hash, inflate(dictionary_id, data), LENGTH(data) FROM confluence_blobs"
+            ).fetchall()
+            for content_hash, body, size in rows:
+                data = compress(body, dictionary)
+                before += size
+                if len(data) < size:
+                    conn.execute(
+                        "UPDATE confluence_blobs SET dictionary_id = ?, data = ? WHERE content_hash = ?",
+                        (dictionary_id, data, content_hash)
+                    )
+                    after += len(data)
+                    recompressed += 1
+                else:
+                    after += size
+            # Older dictionaries that no body uses anymore
+            conn.execute("""
+                DELETE FROM compression_dictionaries WHERE id <> ?
+                AND id NOT IN (SELECT DISTINCT dictionary_id FROM confluence_blobs WHERE dictionary_id IS NOT NULL)
+            """, (dictionary_id,))
+        return {
+            "dictionary_id": dictionary_id,
+            "dictionary_bytes": len(dictionary),
+            "recompressed": recompressed,
+            "blob_bytes_before": before,
+            "blob_bytes_after": after,
+        }
+
+    def run_maintenance(self, retention=None):
+        """Apply the retention policy, train a compression dictionary once enough pages exist, then compact."""
+        rolled = self.apply_retention(retention)
+        trained = None
+        with self.connection() as conn:
+            has_dictionary = conn.execute("SELECT 1 FROM compression_dictionaries LIMIT 1").fetchone()
+            blobs = conn.execute("SELECT COUNT(*) FROM confluence_blobs").fetchone()[0]
+        if not has_dictionary and blobs >= BLOB_DICTIONARY_MIN_PAGES:
+            trained = self.train_compression_dictionary()
+        result = self.compact()
+        result["rolled_up_messages"] = rolled
+        result["compression_dictionary"] = trained
+        return result
+
+    def start_maintenance(self, interval=None):
+        """Run run_maintenance() every interval seconds (MEMORY_RETENTION) in a background thread."""
+        if self._maintenance_stop is not None:
+            return
+        interval = interval or MEMORY_RETENTION["interval_seconds"]
+        self._maintenance_stop = stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    result = self.run_maintenance()
+                    print(f"🧹 Database maintenance: {result}")
+                except sqlite3.Error as e:
+                    print(f"❌ Database maintenance failed: {e}")
+
+        threading.Thread(target=loop, name="sqlite-maintenance", daemon=True).start()
+
+    def stop_maintenance(self):
+        if self._maintenance_stop is not None:
+            self._maintenance_stop.set()
+            self._maintenance_stop = None
+
+    def checkpoint(self, truncate_wal_mb=None):
+        """
+        Checkpoint the WAL: PASSIVE (never waits for readers or writers of other
+        processes), or TRUNCATE once the WAL file is larger than truncate_wal_mb.
+        """
+        if truncate_wal_mb is None:
+            truncate_wal_mb = MULTI_PROCESS["truncate_wal_mb"]
+        limit = truncate_wal_mb * 1024 * 1024
+        wal_path = self.db_path + "-wal"
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        mode = "TRUNCATE" if wal_size > limit else "PASSIVE"
+        busy, wal_pages, checkpointed = self.connection().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {
+            "mode": mode,
+            "wal_size_mb": round(wal_size / (1024 * 1024), 2),
+            "busy": bool(busy),
+            "wal_pages": wal_pages,
+            "checkpointed_pages": checkpointed,
+        }
+
+    def start_checkpoints(self, interval=None):
+        """Run checkpoint() every interval seconds (MULTI_PROCESS) in a background thread."""
+        if self._checkpoint_stop is not None:
+            return
+        interval = interval or MULTI_PROCESS["checkpoint_interval"]
+        self._checkpoint_stop = stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.checkpoint()
+                except sqlite3.Error as e:
+                    print(f"❌ WAL checkpoint failed: {e}")
+
+        threading.Thread(target=loop, name="sqlite-checkpoint", daemon=True).start()
+
+    def stop_checkpoints(self):
+        if self._checkpoint_stop is not None:
+            self._checkpoint_stop.set()
+            self._checkpoint_stop = None
+
     def get_database_stats(self):
         """Get statistics about the database."""
-        with sqlite3.connect(self.db_path) as conn:
+        self.flush()
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Count records in each table
             cursor.execute("SELECT COUNT(*) FROM memory")
             memory_count = cursor.fetchone()[0]
+
+            cursor.execute("SELECT COUNT(*) FROM memory WHERE role = 'summary'")
+            summary_count = cursor.fetchone()[0]
             
             cursor.execute("SELECT COUNT(*) FROM facts")
             facts_count = cursor.fetchone()[0]
             
             cursor.execute("SELECT COUNT(*) FROM confluence_pages")
             confluence_count = cursor.fetchone()[0]
+
+            cursor.execute("SELECT COALESCE(MAX(version), 0), COALESCE(SUM(LENGTH(content)), 0) FROM knowledge_snapshots")
+            snapshot_version, snapshot_chars = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT COALESCE(SUM(b.chars), 0) FROM confluence_pages p
+                JOIN confluence_blobs b ON b.content_hash = p.content_hash
+            """)
+            raw_chars = cursor.fetchone()[0]
+
+            cursor.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM confluence_blobs")
+            blob_bytes = cursor.fetchone()[0]
+
+            cursor.execute("SELECT COALESCE(SUM(LENGTH(normalized)), 0) FROM confluence_normalized")
+            normalized_chars = cursor.fetchone()[0]
+            
+            page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+            free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
             
             # Get database size
             db_size = os.path.getsize(self.db_path)
+            wal_path = self.db_path + "-wal"
+            wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
             
             return {
                 "memory_records": memory_count,
+                "memory_summaries": summary_count,
                 "facts_count": facts_count,
                 "confluence_pages": confluence_count,
-                "database_size_mb": round(db_size / (1024 * 1024), 2)
-            } 
\ No newline at end of file
+                "confluence_raw_chars": raw_chars,
+                "confluence_blob_mb": round(blob_bytes / (1024 * 1024), 2),
+                "confluence_normalized_chars": normalized_chars,
+                "knowledge_snapshot_version": snapshot_version,
+                "knowledge_snapshot_chars": snapshot_chars,
+                "database_size_mb": round(db_size / (1024 * 1024), 2),
+                "free_space_mb": round(free_pages * page_size / (1024 * 1024), 2),
+                "wal_size_mb": round(wal_size / (1024 * 1024), 2)
+            } 
+
+
+# Every public method is a timing span (sqlite_memory.<method>); connection() is too hot to time
+instrument_methods(SQLiteMemory, "sqlite_memory", exclude=("connection",))
@@ -0,0 +1,143 @@
+"""
+Multi-process stress check of SQLiteMemory's multi_process mode.
+
+Spawns --workers writer processes on one database file, the way several app
+workers share agent_memory.db. Each writes --writes chat messages (and every
+tenth write a Confluence page that all workers update, so they contend for
+the same rows) while the parent runs WAL checkpoints. Afterwards every
+message must be in the database exactly once, and the p99 write latency must
+stay below --max-p99-ms without growing over the run. Exit code 1 on failure.
+
+    python sqlite_stress.py                   # 4 workers x 500 writes
+    python sqlite_stress.py --workers 8 --writes 2000 --max-p99-ms 500
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Absolute slack on the latency drift check, so scheduler jitter on fast writes is not a failure
+NOISE_FLOOR_MS = 5.0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def writer(db_path, worker, writes, start_event, results):
+    """Worker process: write the messages of one session and report the latency of each write."""
+    from sqlite_memory import SQLiteMemory
+    from metrics import registry
+
+    memory = SQLiteMemory(db_path, multi_process=True)
+    start_event.wait()
+    latencies = []
+    for seq in range(writes):
+        start = time.perf_counter()
+        memory.add_message("user", f"{worker}:{seq}", session_id=f"stress-{worker}")
+        if seq % 10 == 0:
+            # The same few pages for every worker: concurrent updates of one row
+            memory.add_confluence_page(f"stress-{seq % 50}", f"Stress {seq % 50}", f"<p>{worker} {seq}</p>", seq)
+        latencies.append((time.perf_counter() - start) * 1000)
+    memory.close()
+    results.put((worker, latencies, registry.snapshot().get("counters", {}).get("sqlite_busy_retries", 0)))
+
+
+def run_stress(db_path, workers, writes, checkpoint_interval):
+    from sqlite_memory import SQLiteMemory
+
+    # The parent creates the schema, so the workers only open it
+    memory = SQLiteMemory(db_path, multi_process=True)
+    memory.start_checkpoints(interval=checkpoint_interval)
+
+    context = multiprocessing.get_context("spawn")
+    start_event = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=writer, args=(db_path, worker, writes, start_event, results))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    start = time.perf_counter()
+    start_event.set()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    duration = time.perf_counter() - start
+    memory.stop_checkpoints()
+    checkpoint = memory.checkpoint(truncate_wal_mb=0)
+
+    with memory.connection() as conn:
+        rows = conn.execute(
+            "SELECT session_id, message, COUNT(*) FROM memory WHERE session_id LIKE 'stress-%' GROUP BY session_id, message"
+        ).fetchall()
+    memory.close()
+
+    expected = {(f"stress-{worker}", f"{worker}:{seq}") for worker in range(workers) for seq in range(writes)}
+    found = {(session_id, message): count for session_id, message, count in rows}
+    latencies = [latency for _, worker_latencies, _ in reports for latency in worker_latencies]
+    # Per worker halves, so a slow start of one process does not look like drift
+    first = [latency for _, worker_latencies, _ in reports for latency in worker_latencies[:writes // 2]]
+    last = [latency for _, worker_latencies, _ in reports for latency in worker_latencies[writes // 2:]]
+    return {
+        "writes": len(expected),
+        "lost": len(expected - set(found)),
+        "duplicated": sum(1 for count in found.values() if count > 1),
+        "unexpected": len(set(found) - expected),
+        "exit_codes": [process.exitcode for process in processes],
+        "busy_retries": sum(retries for _, _, retries in reports),
+        "duration": round(duration, 2),
+        "writes_per_second": round(len(latencies) / duration, 1),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(max(latencies), 3),
+        "p99_first_half_ms": round(percentile(first, 0.99), 3),
+        "p99_last_half_ms": round(percentile(last, 0.99), 3),
+        "checkpoint": checkpoint,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="number of writer processes")
+    parser.add_argument("--writes", type=int, default=500, help="messages per writer")
+    parser.add_argument("--max-p99-ms", type=float, default=250.0, help="allowed p99 write latency")
+    parser.add_argument("--max-drift", type=float, default=3.0, help="allowed growth of the p99 from the first to the second half")
+    parser.add_argument("--checkpoint-interval", type=float, default=0.2, help="seconds between checkpoints in the parent")
+    parser.add_argument("--db", help="database file to use (default: a new one in a temporary directory)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, "stress.db")
+        result = run_stress(db_path, args.workers, args.writes, args.checkpoint_interval)
+
+    print(f"{args.workers} workers x {args.writes} writes in {result['duration']}s "
+          f"({result['writes_per_second']} writes/s, {result['busy_retries']} busy retries)")
+    print(f"Latency p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, max {result['max_ms']} ms "
+          f"(p99 first half {result['p99_first_half_ms']} ms, second half {result['p99_last_half_ms']} ms)")
+    print(f"Final checkpoint: {result['checkpoint']}")
+
+    failures = []
+    if any(code != 0 for code in result["exit_codes"]):
+        failures.append(f"writer exit codes {result['exit_codes']}")
+    if result["lost"] or result["duplicated"] or result["unexpected"]:
+        failures.append(f"{result['lost']} lost, {result['duplicated']} duplicated, "
+                        f"{result['unexpected']} unexpected of {result['writes']} writes")
+    if result["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {result['p99_ms']} ms above {args.max_p99_ms} ms")
+    if result["p99_last_half_ms"] > result["p99_first_half_ms"] * args.max_drift + NOISE_FLOOR_MS:
+        failures.append(f"p99 grew from {result['p99_first_half_ms']} ms to {result['p99_last_half_ms']} ms")
+    if failures:
+        print("\n❌ " + "; ".join(failures))
+        return 1
+    print(f"\n✅ All {result['writes']} writes stored exactly once")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Offline semantic index over the section-level chunks of the stored Confluence pages.
+
+Every chunk becomes a hashed TF-IDF vector over words and character n-grams,
+so paraphrases and word variants ("key"/"keys", Dutch compounds) still match.
+The L2-normalized vectors are stored as a float32 .npy matrix next to the
+database and opened with mmap_mode="r": loading is zero-copy and only the rows
+that are scanned are paged in. Chunk texts are not kept in memory; they are
+re-read from the database for the results only.
+
+Several processes may rebuild the index at the same time: every build writes
+to its own temp files, and the metadata records the row count and checksums
+of the matrix and idf files it belongs to, so files of different builds are
+never used together.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from confluence_config import get_retrieval_config, get_vector_index_config
+from retrieval import format_chunk, split_into_chunks, tokenize
+
+INDEX_VERSION = 2
+
+# Attempts of _load() to find the matrix, idf and metadata of one build
+LOAD_ATTEMPTS = 3
+
+
+def hashed_features(text, dimensions, char_ngrams=3):
+    """Count of every hashed word and character n-gram bucket in text."""
+    features = Counter()
+    for token in tokenize(text):
+        features[zlib.crc32(b"w:" + token.encode("utf-8")) % dimensions] += 1
+        if char_ngrams and len(token) > char_ngrams:
+            padded = f"<{token}>"
+            for i in range(len(padded) - char_ngrams + 1):
+                gram = padded[i:i + char_ngrams]
+                features[zlib.crc32(b"c:" + gram.encode("utf-8")) % dimensions] += 1
+    return features
+
+
+class VectorIndex:
+    """
+    Hashed TF-IDF vectors of all chunks in a memory-mapped matrix, rebuilt
+    whenever the stored pages change (see SQLiteMemory.get_confluence_fingerprint).
+    """
+
+    def __init__(self, memory, directory, config=None, chunk_chars=None):
+        self.memory = memory
+        self.config = config or get_vector_index_config()
+        self.chunk_chars = chunk_chars or get_retrieval_config()["chunk_chars"]
+        self.matrix_path = os.path.join(directory, "confluence_vectors.npy")
+        self.idf_path = os.path.join(directory, "confluence_vectors_idf.npy")
+        self.meta_path = os.path.join(directory, "confluence_vectors.json")
+        self._matrix = None
+        self._idf = None
+        self._meta = None
+        self._lock = threading.Lock()
+
+    def _vector(self, text, idf):
+        """L2-normalized, sublinear TF-IDF vector of text."""
+        vector = np.zeros(self.config["dimensions"], dtype=np.float32)
+        for bucket, tf in hashed_features(text, self.config["dimensions"], self.config["char_ngrams"]).items():
+            vector[bucket] = (1.0 + math.log(tf)) * idf[bucket]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _iter_chunks(self):
+        """Yield (position within its page, chunk) for every chunk of every stored page."""
+        for page_id, title, content in self.memory.get_all_confluence_page_contents(normalized=True):
+            for ordinal, chunk in enumerate(split_into_chunks(page_id, title, content, self.chunk_chars)):
+                yield ordinal, chunk
+
+    def _tmp_path(self, path):
+        """A new, unique temp file next to path; removed again by the caller."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=os.path.splitext(path)[1])
+        os.close(fd)
+        return tmp_path
+
+    def _stamp(self, matrix, idf):
+        """Row count and checksums that tie a matrix and idf vector to their metadata."""
+        edge_rows = matrix[[0, -1]] if len(matrix) else matrix
+        return {
+            "rows": int(matrix.shape[0]),
+            "idf_crc": zlib.crc32(np.ascontiguousarray(idf).tobytes()),
+            "rows_crc": zlib.crc32(np.ascontiguousarray(edge_rows).tobytes()),
+        }
+
+    def build(self):
+        """Write the matrix, idf vector and chunk metadata; files are replaced atomically."""
+        dimensions = self.config["dimensions"]
+        fingerprint = self.memory.get_confluence_fingerprint()
+        # One snapshot for both passes, so a sync in between cannot change the row count
+        snapshot = list(self._iter_chunks())
+
+        # First pass: document frequencies and chunk metadata
+        doc_freqs = np.zeros(dimensions, dtype=np.float64)
+        chunks = []
+        for ordinal, chunk in snapshot:
+            buckets = list(hashed_features(
+                f"{chunk['title']} {chunk['heading']} {chunk['text']}", dimensions, self.config["char_ngrams"]
+            ))
+            doc_freqs[buckets] += 1
+            chunks.append({"page_id": chunk["page_id"], "title": chunk["title"],
+                           "heading": chunk["heading"], "ordinal": ordinal})
+        idf = (np.log((1 + len(chunks)) / (1 + doc_freqs)) + 1).astype(np.float32)
+
+        tmp_matrix = self._tmp_path(self.matrix_path)
+        tmp_idf = self._tmp_path(self.idf_path)
+        tmp_meta = self._tmp_path(self.meta_path)
+        try:
+            # Second pass: write the vectors row by row into a memory-mapped file
+            matrix = np.lib.format.open_memmap(
+                tmp_matrix, mode="w+", dtype=np.float32, shape=(len(chunks), dimensions)
+            )
+            for row, (ordinal, chunk) in enumerate(snapshot):
+                matrix[row] = self._vector(f"{chunk['title']} {chunk['heading']} {chunk['text']}", idf)
+            matrix.flush()
+            stamp = self._stamp(matrix, idf)
+            del matrix, snapshot
+
+            with open(tmp_idf, "wb") as f:
+                np.save(f, idf)
+            meta = {
+                "index_version": INDEX_VERSION,
+                "fingerprint": fingerprint,
+                "dimensions": dimensions,
+                "char_ngrams": self.config["char_ngrams"],
+                "chunk_chars": self.chunk_chars,
+                **stamp,
+                "chunks": chunks,
+            }
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_matrix, self.matrix_path)
+            os.replace(tmp_idf, self.idf_path)
+            # Metadata last: it marks the files as complete
+            os.replace(tmp_meta, self.meta_path)
+        finally:
+            for leftover in (tmp_matrix, tmp_idf, tmp_meta):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return len(chunks)
+
+    def _is_current(self, meta, fingerprint):
+        return (
+            meta is not None
+            and meta.get("index_version") == INDEX_VERSION
+            and meta.get("fingerprint") == fingerprint
+            and meta.get("dimensions") == self.config["dimensions"]
+            and meta.get("char_ngrams") == self.config["char_ngrams"]
+            and meta.get("chunk_chars") == self.chunk_chars
+        )
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load(self):
+        """Open the index (building it first when missing or outdated); the matrix is memory-mapped."""
+        fingerprint = self.memory.get_confluence_fingerprint()
+        with self._lock:
+            if self._is_current(self._meta, fingerprint):
+                return self._matrix, self._idf, self._meta
+            rebuild = False
+            for _ in range(LOAD_ATTEMPTS):
+                meta = self._read_meta()
+                if rebuild or not self._is_current(meta, fingerprint):
+                    self.build()
+                    meta = self._read_meta()
+                try:
+                    matrix = np.load(self.matrix_path, mmap_mode="r")
+                    idf = np.load(self.idf_path)
+                except (OSError, ValueError):
+                    # Another process is replacing the files right now
+                    rebuild = True
+                    continue
+                stamp = self._stamp(matrix, idf)
+                if (all(meta.get(key) == value for key, value in stamp.items())
+                        and len(meta["chunks"]) == stamp["rows"]):
+                    self._matrix, self._idf, self._meta = matrix, idf, meta
+                    return self._matrix, self._idf, self._meta
+                # Files of another build (a concurrent rebuild in another process); build our own
+                rebuild = True
+            raise RuntimeError(f"Vector index in {os.path.dirname(self.matrix_path)} keeps changing during loading")
+
+    def _chunk_text(self, chunk, cache):
+        """Re-split the page of a result to get the text of its chunk."""
+        page_id = chunk["page_id"]
+        if page_id not in cache:
+            content = self.memory.get_normalized_content(page_id) or ""
+            cache[page_id] = split_into_chunks(page_id, chunk["title"], content, self.chunk_chars)
+        page_chunks = cache[page_id]
+        return page_chunks[chunk["ordinal"]]["text"] if chunk["ordinal"] < len(page_chunks) else ""
+
+    def search_batch(self, queries, top_k=None):
+        """
+        Cosine top-k for several queries at once. Returns one list of
+        (score, chunk) pairs per query, best first.
+        """
+        top_k = top_k or self.config["top_k"]
+        matrix, idf, meta = self._load()
+        if not queries:
+            return []
+        if not len(meta["chunks"]):
+            return [[] for _ in queries]
+        query_matrix = np.stack([self._vector(query, idf) for query in queries])
+
+        # Scan the matrix in blocks so only one block is paged in and multiplied at a time
+        best_scores = np.full((len(queries), 0), -1.0, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        block_rows = self.config["block_rows"]
+        for start in range(0, matrix.shape[0], block_rows):
+            scores = query_matrix @ matrix[start:start + block_rows].T
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate(
+                [best_rows, np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)], axis=1
+            )
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        results, text_cache = [], {}
+        for scores, rows in zip(best_scores, best_rows):
+            hits = []
+            for i in np.argsort(-scores):
+                if scores[i] < self.config["min_score"]:
+                    break
+                chunk = dict(meta["chunks"][rows[i]])
+                chunk["text"] = self._chunk_text(chunk, text_cache)
+                hits.append((float(scores[i]), chunk))
+            results.append(hits)
+        return results
+
+    def search(self, query, top_k=None):
+        """Cosine top-k for a single query as (score, chunk) pairs."""
+        return self.search_batch([query], top_k)[0]
+
+    def get_context(self, query, top_k=None):
+        """Format the best matching chunks as text for the agent."""
+        return "\n\n".join(
+            f"{format_chunk(chunk)}\n(score {score:.2f})" for score, chunk in self.search(query, top_k)
+        )